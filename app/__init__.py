@@ -5,22 +5,24 @@
 This is a web service to print labels on Brother QL label printers.
 """
 
+import os
 import sys
 import random
 import argparse
 
-from flask import Flask
-from flask_bootstrap import Bootstrap
-
-from brother_ql.devicedependent import models
-
-from . import fonts
+from . import events, fonts, profiling, scheduler
 from config import Config
 
-bootstrap = Bootstrap()
+# Flask and brother_ql are imported in the functions, so the label modules
+# can be used by the command line interface without loading them.
+bootstrap = None
 
 
 def create_app(config_class=Config):
+    global bootstrap
+    from flask import Flask
+    from flask_bootstrap import Bootstrap
+
     app = Flask(__name__, instance_relative_config=True)
     app.config.from_object(config_class)
     app.config.from_pyfile('application.py', silent=True)
@@ -29,7 +31,14 @@ def create_app(config_class=Config):
 
     main(app)
 
+    profiling.init_app(app)
+
+    global EVENTS, PRINT_SCHEDULER
+    EVENTS = events.EventPublisher(max_subscribers=app.config['EVENTS_MAX_SUBSCRIBERS'])
+    PRINT_SCHEDULER = scheduler.PrintScheduler(EVENTS)
+
     app.config['BOOTSTRAP_SERVE_LOCAL'] = True
+    bootstrap = Bootstrap()
     bootstrap.init_app(app)
 
     from app.main import bp as main_bp
@@ -47,7 +56,7 @@ def create_app(config_class=Config):
 def main(app):
     global FONTS
 
-    FONTS = fonts.Fonts()
+    FONTS = fonts.Fonts(app.config['LABEL_FALLBACK_FONT_FAMILIES'])
     FONTS.scan_global_fonts()
 
     parse_args(app)
@@ -55,6 +64,13 @@ def main(app):
     if app.config['FONT_FOLDER']:
         FONTS.scan_fonts_folder(app.config['FONT_FOLDER'])
 
+    if app.config['FONT_INDEX_FILE']:
+        try:
+            os.makedirs(os.path.dirname(app.config['FONT_INDEX_FILE']), exist_ok=True)
+            FONTS.save_index(app.config['FONT_INDEX_FILE'])
+        except OSError as e:
+            app.logger.warn('Could not write the font index: {}'.format(e))
+
     if not FONTS.fonts_available():
         app.logger.error(
             "Not a single font was found on your system. Please install some.\n")
@@ -76,6 +92,8 @@ def main(app):
 
 
 def parse_args(app):
+    from brother_ql.devicedependent import models
+
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('--default-label-size', default=False,
                         help='Label size inserted in your printer. Defaults to 62.')
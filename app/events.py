@@ -0,0 +1,115 @@
+"""
+In-process publisher for the Server-Sent Events stream of the job state,
+the queue depth and the printer status.
+
+Every event is serialized once and kept in a short history. Subscribers
+don't get queues of their own: they remember the id of the last event they
+have sent and wait on a shared condition. Reconnecting clients continue
+after their Last-Event-ID while it's still in the history, otherwise (and
+on the first connect) they get the latest state of every retained event.
+
+An open stream occupies its connection for as long as the client stays
+connected. Served by a gevent worker that is a greenlet, with a threaded
+server it's a thread, so the number of open streams is capped as a safety
+limit.
+"""
+
+import json
+import threading
+from collections import deque
+
+
+class EventPublisher:
+    def __init__(self, history=256, max_subscribers=0):
+        """
+        :param history: number of events kept for reconnecting clients
+        :param max_subscribers: maximum number of open streams, 0 for no limit
+        """
+        self._max_subscribers = max_subscribers
+        self._subscribers = 0
+        self._condition = threading.Condition()
+        self._events = deque(maxlen=history)
+        self._last_id = 0
+        # event name -> payload of the latest event published with retain=True
+        self._retained = {}
+
+    def publish(self, event, data, retain=False):
+        """ sends an event to all subscribers
+        :param event: name of the event, e.g. 'job'
+        :param data: JSON serializable payload
+        :param retain: keep the payload as the current state sent to new subscribers
+        """
+        payload = json.dumps(data)
+        with self._condition:
+            self._last_id += 1
+            self._events.append((self._last_id, event, payload))
+            if retain:
+                self._retained[event] = payload
+            self._condition.notify_all()
+
+    def _get_events(self, last_id):
+        """ gets the events after last_id, the condition has to be held
+        :return: list of (id, event, payload) tuples
+        """
+        if last_id is None or (self._events and self._events[0][0] > last_id + 1) or last_id > self._last_id:
+            # a new subscriber or one which missed events: start with the current state
+            return [(self._last_id, event, payload) for event, payload in self._retained.items()]
+        events = []
+        for item in reversed(self._events):
+            if item[0] <= last_id:
+                break
+            events.append(item)
+        events.reverse()
+        return events
+
+    def subscribe(self, last_id=None, keepalive=15):
+        """ yields the published events forever
+        :param last_id: id of the last event the client received
+        :param keepalive: yield None after this many seconds without events
+        :return: generator of (id, event, payload) tuples or None
+        """
+        while True:
+            with self._condition:
+                events = self._get_events(last_id)
+                last_id = self._last_id
+                if not events:
+                    self._condition.wait(keepalive)
+                    events = self._get_events(last_id)
+                    last_id = self._last_id
+            if not events:
+                yield None
+            for item in events:
+                yield item
+
+    def stream(self, last_event_id=None, keepalive=15):
+        """ formats the published events as a text/event-stream
+        :param last_event_id: the Last-Event-ID header of a reconnecting client
+        :return: generator of the stream or None if max_subscribers streams are open
+        """
+        try:
+            last_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            last_id = None
+
+        with self._condition:
+            if self._max_subscribers and self._subscribers >= self._max_subscribers:
+                return None
+            self._subscribers += 1
+        stream = self._stream(last_id, keepalive)
+        # enter the try block, so closing the stream releases the slot even if it never ran
+        next(stream)
+        return stream
+
+    def _stream(self, last_id, keepalive):
+        try:
+            yield None
+            yield 'retry: 3000\n\n'
+            for item in self.subscribe(last_id, keepalive):
+                if item is None:
+                    # a comment keeps proxies from closing idle connections
+                    yield ': keepalive\n\n'
+                else:
+                    yield 'id: {}\nevent: {}\ndata: {}\n\n'.format(*item)
+        finally:
+            with self._condition:
+                self._subscribers -= 1
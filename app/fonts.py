@@ -1,11 +1,43 @@
+import json
 import subprocess
 import sys
+from bisect import bisect_right
 from collections import defaultdict
 
+FC_FORMAT = '%{file}:%{family}:style=%{style}:charset=%{charset}\n'
+
+# styles preferred when picking a fallback font, best first
+FALLBACK_STYLES = ('Regular', 'Book', 'Medium', 'Normal')
+
+
+def parse_charset(charset):
+    """ parses a fontconfig charset like '20-7e a0-17f 2010'
+    :return: the range starts and the (inclusive) range ends as two sorted lists
+    """
+    starts, ends = [], []
+    for token in charset.split():
+        first, _, last = token.partition('-')
+        try:
+            start = int(first, 16)
+            end = int(last, 16) if last else start
+        except ValueError:
+            continue
+        if starts and start <= ends[-1] + 1:
+            ends[-1] = max(ends[-1], end)
+        else:
+            starts.append(start)
+            ends.append(end)
+    return starts, ends
+
 
 class Fonts:
-    def __init__(self):
+    def __init__(self, fallback_families=()):
         self.fonts = defaultdict(dict)
+        # font path -> (range starts, range ends) of the covered codepoints
+        self.coverage = {}
+        self.fallback_families = tuple(fallback_families)
+        self._fallback_order = None
+        self._fallback_cache = {}
 
     def parse_fonts(self, raw):
         """ adds the found fonts the the fonts list
@@ -20,6 +52,9 @@ class Fonts:
             font = line.split(':')
             if len(font) < 3:
                 continue
+            charset = None
+            if font[-1].startswith('charset='):
+                charset = font.pop()[8:]
             # ignore non true type fonts
             if '.ttf' in font[0] or '.otf' in font[0]:
                 fontname = font[1].replace('\\', '')
@@ -31,14 +66,19 @@ class Fonts:
                 fontname = fontname.strip()
 
                 self.fonts[fontname][fontstyle] = fontpath
+                if charset is not None:
+                    self.coverage[fontpath] = parse_charset(charset)
             else:
                 pass
 
+        self._fallback_order = None
+        self._fallback_cache.clear()
+
     def scan_global_fonts(self):
         """ Get a list of all fonts that are available to the user who runs this
         :return: raw output of the command fc-list
         """
-        command = ['fc-list']
+        command = ['fc-list', '--format', FC_FORMAT]
         try:
             raw = subprocess.run(command, stdout=subprocess.PIPE)
         except FileNotFoundError:
@@ -51,8 +91,7 @@ class Fonts:
         """ Get a list of all fonts that are available to the user who runs this
         :return: raw output of the command fc-list
         """
-        cmd = ['fc-scan', '--format',
-               '%{file}:%{family}:style=%{style}\n', folder]
+        cmd = ['fc-scan', '--format', FC_FORMAT, folder]
         try:
             raw = subprocess.run(cmd, stdout=subprocess.PIPE)
         except FileNotFoundError:
@@ -69,3 +108,97 @@ class Fonts:
             return False
         else:
             return len(self.fonts)
+
+    def save_index(self, path):
+        """ writes the fonts and their glyph coverage to a json file
+        :param path: file to write the index to
+        """
+        index = {
+            'fonts': self.fonts,
+            'coverage': {font_path: [starts, ends] for font_path, (starts, ends) in self.coverage.items()},
+        }
+        with open(path, 'w') as f:
+            json.dump(index, f)
+
+    def load_index(self, path):
+        """ reads fonts and glyph coverage written by save_index()
+        :param path: file to read the index from
+        """
+        with open(path) as f:
+            index = json.load(f)
+
+        for family, styles in index['fonts'].items():
+            self.fonts[family].update(styles)
+        for font_path, (starts, ends) in index['coverage'].items():
+            self.coverage[font_path] = (starts, ends)
+
+        self._fallback_order = None
+        self._fallback_cache.clear()
+
+    def covers(self, font_path, codepoint):
+        """ checks if a font has a glyph for the codepoint
+        :return: true if covered or if the coverage of the font is unknown
+        """
+        try:
+            starts, ends = self.coverage[font_path]
+        except KeyError:
+            return True
+        i = bisect_right(starts, codepoint) - 1
+        return i >= 0 and codepoint <= ends[i]
+
+    def _get_fallback_order(self):
+        if self._fallback_order is None:
+            preferred = {family: rank for rank, family in enumerate(self.fallback_families)}
+            candidates = []
+            for family, styles in self.fonts.items():
+                for style, font_path in styles.items():
+                    if font_path not in self.coverage:
+                        continue
+                    style_rank = FALLBACK_STYLES.index(style) if style in FALLBACK_STYLES else len(FALLBACK_STYLES)
+                    candidates.append((
+                        preferred.get(family, len(preferred)), style_rank, family.lower(), font_path))
+            self._fallback_order = [candidate[-1] for candidate in sorted(candidates)]
+        return self._fallback_order
+
+    def fallback_font(self, codepoint):
+        """ finds a font covering the codepoint
+        :return: path of the font or None if no font has a glyph for it
+        """
+        try:
+            return self._fallback_cache[codepoint]
+        except KeyError:
+            pass
+        font_path = None
+        for candidate in self._get_fallback_order():
+            if self.covers(candidate, codepoint):
+                font_path = candidate
+                break
+        self._fallback_cache[codepoint] = font_path
+        return font_path
+
+    def split_runs(self, text, font_path):
+        """ splits text into runs which can be drawn with a single font each
+        :param text: the text to split
+        :param font_path: the font which should be used if it covers the characters
+        :return: list of (text, font path) tuples
+        """
+        if font_path not in self.coverage:
+            return [(text, font_path)]
+
+        runs = []
+        run_start = 0
+        run_font = font_path
+        for i, char in enumerate(text):
+            codepoint = ord(char)
+            if codepoint < 0x20 or self.covers(font_path, codepoint):
+                char_font = font_path
+            else:
+                char_font = self.fallback_font(codepoint) or font_path
+            if char_font != run_font:
+                if i > run_start:
+                    runs.append((text[run_start:i], run_font))
+                run_start = i
+                run_font = char_font
+        if run_start < len(text):
+            runs.append((text[run_start:], run_font))
+        return runs
@@ -1,5 +1,12 @@
-from flask import Blueprint
+def __getattr__(name):
+    # The blueprint (and Flask with it) is only loaded when the web app asks
+    # for it, the label modules of this package are used without Flask too.
+    if name == 'bp':
+        global bp
+        from flask import Blueprint
 
-bp = Blueprint('labeldesigner', __name__, template_folder = 'templates')
+        bp = Blueprint('labeldesigner', __name__, template_folder = 'templates')
 
-from app.labeldesigner import routes
\ No newline at end of file
+        from app.labeldesigner import routes
+        return bp
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
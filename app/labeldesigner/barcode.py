@@ -0,0 +1,386 @@
+"""
+Barcode encoders for the label designer.
+
+The encoders only compute the module pattern of a symbol, i.e. a list of
+rows where every row is a list of 0 (space) and 1 (bar). The label draws
+these modules directly onto its canvas with a whole number of printer dots
+per module, so no intermediate image has to be created and resampled.
+"""
+
+# Bar/space widths for the Code 128 symbol values 0..106 (106 is the stop pattern)
+CODE128_PATTERNS = (
+    '212222', '222122', '222221', '121223', '121322', '131222', '122213', '122312',
+    '132212', '221213', '221312', '231212', '112232', '122132', '122231', '113222',
+    '123122', '123221', '223211', '221132', '221231', '213212', '223112', '312131',
+    '311222', '321122', '321221', '312212', '322112', '322211', '212123', '212321',
+    '232121', '111323', '131123', '131321', '112313', '132113', '132311', '211313',
+    '231113', '231311', '112133', '112331', '132131', '113123', '113321', '133121',
+    '313121', '211331', '231131', '213113', '213311', '213131', '311123', '311321',
+    '331121', '312113', '312311', '332111', '314111', '221411', '431111', '111224',
+    '111422', '121124', '121421', '141122', '141221', '112214', '112412', '122114',
+    '122411', '142112', '142211', '241211', '221114', '413111', '241112', '134111',
+    '111242', '121142', '121241', '114212', '124112', '124211', '411212', '421112',
+    '421211', '212141', '214121', '412121', '111143', '111341', '131141', '114113',
+    '114311', '411113', '411311', '113141', '114131', '311141', '411131', '211412',
+    '211214', '211232', '2331112',
+)
+
+CODE128_START_B = 104
+CODE128_START_C = 105
+CODE128_CODE_B = 100
+CODE128_CODE_C = 99
+CODE128_STOP = 106
+
+EAN13_L_CODES = (
+    '0001101', '0011001', '0010011', '0111101', '0100011',
+    '0110001', '0101111', '0111011', '0110111', '0001011',
+)
+EAN13_PARITY = (
+    'LLLLLL', 'LLGLGG', 'LLGGLG', 'LLGGGL', 'LGLLGG',
+    'LGGLLG', 'LGGGLL', 'LGLGLG', 'LGLGGL', 'LGGLGL',
+)
+
+# Square ECC 200 symbols: (size, data codewords, error codewords, interleaved blocks)
+DATAMATRIX_SIZES = (
+    (10, 3, 5, 1), (12, 5, 7, 1), (14, 8, 10, 1), (16, 12, 12, 1),
+    (18, 18, 14, 1), (20, 22, 18, 1), (22, 30, 20, 1), (24, 36, 24, 1),
+    (26, 44, 28, 1), (32, 62, 36, 1), (36, 86, 42, 1), (40, 114, 48, 1),
+    (44, 144, 56, 1), (48, 174, 68, 1), (52, 204, 84, 2), (64, 280, 112, 2),
+    (72, 368, 144, 4), (80, 456, 192, 4), (88, 576, 224, 4), (96, 696, 272, 4),
+    (104, 816, 336, 6), (120, 1050, 408, 6), (132, 1304, 496, 8), (144, 1558, 620, 10),
+)
+
+# Quiet zones (left, right) in modules as required by the symbologies
+QUIET_ZONES = {
+    'code128': (10, 10),
+    'ean13': (11, 7),
+    'datamatrix': (1, 1),
+}
+
+
+def _widths_to_modules(widths):
+    modules = []
+    for i, width in enumerate(widths):
+        modules.extend([1 - i % 2] * int(width))
+    return modules
+
+
+def _code128_values(data):
+    values = []
+    subset = None
+    i = 0
+    while i < len(data):
+        run = 0
+        while i + run < len(data) and data[i + run] in '0123456789':
+            run += 1
+
+        if run >= 4 or (run >= 2 and run % 2 == 0 and i + run == len(data) and subset != 'B'):
+            if run % 2:
+                # encode the odd leading digit in subset B first
+                if subset != 'B':
+                    values.append(CODE128_START_B if subset is None else CODE128_CODE_B)
+                    subset = 'B'
+                values.append(ord(data[i]) - 32)
+                i += 1
+                run -= 1
+            if subset != 'C':
+                values.append(CODE128_START_C if subset is None else CODE128_CODE_C)
+                subset = 'C'
+            for pos in range(i, i + run, 2):
+                values.append(int(data[pos:pos + 2]))
+            i += run
+        else:
+            char = data[i]
+            if not 32 <= ord(char) <= 127:
+                raise ValueError(
+                    "Code 128 can't encode the character {!r}".format(char))
+            if subset != 'B':
+                values.append(CODE128_START_B if subset is None else CODE128_CODE_B)
+                subset = 'B'
+            values.append(ord(char) - 32)
+            i += 1
+
+    checksum = values[0]
+    for weight, value in enumerate(values[1:], start=1):
+        checksum += weight * value
+    values.append(checksum % 103)
+    values.append(CODE128_STOP)
+    return values
+
+
+def encode_code128(data):
+    """ encodes data with Code 128 (subsets B and C)
+    :param data: printable ASCII text
+    :return: a single row of modules
+    """
+    if not data:
+        raise ValueError("Code 128 needs at least one character")
+
+    modules = []
+    for value in _code128_values(data):
+        modules.extend(_widths_to_modules(CODE128_PATTERNS[value]))
+    return [modules]
+
+
+def ean13_checksum(digits):
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits[:12]))
+    return (10 - total % 10) % 10
+
+
+def encode_ean13(data):
+    """ encodes data as EAN-13
+    :param data: 12 digits (the check digit is added) or 13 digits
+    :return: a single row of modules
+    """
+    data = data.strip()
+    if not data.isdigit() or len(data) not in (12, 13):
+        raise ValueError("EAN-13 needs 12 or 13 digits")
+    if len(data) == 12:
+        data += str(ean13_checksum(data))
+    elif int(data[12]) != ean13_checksum(data):
+        raise ValueError("Invalid EAN-13 check digit")
+
+    bits = '101'
+    for digit, parity in zip(data[1:7], EAN13_PARITY[int(data[0])]):
+        code = EAN13_L_CODES[int(digit)]
+        if parity == 'G':
+            # G codes are the reversed complement of the L codes
+            code = ''.join('1' if b == '0' else '0' for b in reversed(code))
+        bits += code
+    bits += '01010'
+    for digit in data[7:]:
+        bits += ''.join('1' if b == '0' else '0' for b in EAN13_L_CODES[int(digit)])
+    bits += '101'
+    return [[int(b) for b in bits]]
+
+
+def _gf256_tables():
+    exp = [0] * 512
+    log = [0] * 256
+    value = 1
+    for i in range(255):
+        exp[i] = value
+        log[value] = i
+        value <<= 1
+        if value & 0x100:
+            value ^= 0x12D
+    for i in range(255, 512):
+        exp[i] = exp[i - 255]
+    return exp, log
+
+
+GF_EXP, GF_LOG = _gf256_tables()
+
+
+def _gf_mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return GF_EXP[GF_LOG[a] + GF_LOG[b]]
+
+
+def _reed_solomon(data, ecc_length):
+    generator = [1]
+    for i in range(1, ecc_length + 1):
+        generator = [c ^ _gf_mul(p, GF_EXP[i]) for c, p in zip(generator + [0], [0] + generator)]
+    # the generator coefficients are ordered from the highest power of x down
+    ecc = [0] * ecc_length
+    for codeword in data:
+        factor = codeword ^ ecc[0]
+        ecc = ecc[1:] + [0]
+        for k in range(ecc_length):
+            ecc[k] ^= _gf_mul(generator[k + 1], factor)
+    return ecc
+
+
+def _datamatrix_codewords(data):
+    raw = data.encode('latin-1') if isinstance(data, str) else data
+    codewords = []
+    i = 0
+    while i < len(raw):
+        if i + 1 < len(raw) and 48 <= raw[i] <= 57 and 48 <= raw[i + 1] <= 57:
+            codewords.append(130 + int(raw[i:i + 2]))
+            i += 2
+        elif raw[i] > 127:
+            codewords.extend([235, raw[i] - 127])
+            i += 1
+        else:
+            codewords.append(raw[i] + 1)
+            i += 1
+    return codewords
+
+
+def _datamatrix_placement(nrow, ncol):
+    """ computes the ECC 200 module placement
+    :return: matrix of (codeword index, bit) tuples or None for the fixed corner pattern
+    """
+    array = [[None] * ncol for _ in range(nrow)]
+    placed = [[False] * ncol for _ in range(nrow)]
+
+    def module(row, col, index, bit):
+        if row < 0:
+            row += nrow
+            col += 4 - ((nrow + 4) % 8)
+        if col < 0:
+            col += ncol
+            row += 4 - ((ncol + 4) % 8)
+        array[row][col] = (index, bit)
+        placed[row][col] = True
+
+    def utah(row, col, index):
+        module(row - 2, col - 2, index, 0)
+        module(row - 2, col - 1, index, 1)
+        module(row - 1, col - 2, index, 2)
+        module(row - 1, col - 1, index, 3)
+        module(row - 1, col, index, 4)
+        module(row, col - 2, index, 5)
+        module(row, col - 1, index, 6)
+        module(row, col, index, 7)
+
+    def corner(index, positions):
+        for bit, (row, col) in enumerate(positions):
+            module(row, col, index, bit)
+
+    index = 0
+    row, col = 4, 0
+    while True:
+        if row == nrow and col == 0:
+            corner(index, ((nrow - 1, 0), (nrow - 1, 1), (nrow - 1, 2), (0, ncol - 2),
+                           (0, ncol - 1), (1, ncol - 1), (2, ncol - 1), (3, ncol - 1)))
+            index += 1
+        if row == nrow - 2 and col == 0 and ncol % 4:
+            corner(index, ((nrow - 3, 0), (nrow - 2, 0), (nrow - 1, 0), (0, ncol - 4),
+                           (0, ncol - 3), (0, ncol - 2), (0, ncol - 1), (1, ncol - 1)))
+            index += 1
+        if row == nrow - 2 and col == 0 and ncol % 8 == 4:
+            corner(index, ((nrow - 3, 0), (nrow - 2, 0), (nrow - 1, 0), (0, ncol - 2),
+                           (0, ncol - 1), (1, ncol - 1), (2, ncol - 1), (3, ncol - 1)))
+            index += 1
+        if row == nrow + 4 and col == 2 and ncol % 8 == 0:
+            corner(index, ((nrow - 1, 0), (nrow - 1, ncol - 1), (0, ncol - 3), (0, ncol - 2),
+                           (0, ncol - 1), (1, ncol - 3), (1, ncol - 2), (1, ncol - 1)))
+            index += 1
+
+        # sweep upward diagonally
+        while True:
+            if row < nrow and col >= 0 and not placed[row][col]:
+                utah(row, col, index)
+                index += 1
+            row -= 2
+            col += 2
+            if not (row >= 0 and col < ncol):
+                break
+        row += 1
+        col += 3
+
+        # sweep downward diagonally
+        while True:
+            if row >= 0 and col < ncol and not placed[row][col]:
+                utah(row, col, index)
+                index += 1
+            row += 2
+            col -= 2
+            if not (row < nrow and col >= 0):
+                break
+        row += 3
+        col += 1
+
+        if not (row < nrow or col < ncol):
+            break
+
+    if not placed[nrow - 1][ncol - 1]:
+        # fixed pattern in the lower right corner if it's left unfilled
+        array[nrow - 1][ncol - 1] = array[nrow - 2][ncol - 2] = 1
+        array[nrow - 1][ncol - 2] = array[nrow - 2][ncol - 1] = 0
+
+    return array
+
+
+def encode_datamatrix(data):
+    """ encodes data as a square ECC 200 Data Matrix using ASCII encodation
+    :param data: text to encode (latin-1)
+    :return: the rows of modules
+    """
+    try:
+        codewords = _datamatrix_codewords(data)
+    except UnicodeEncodeError:
+        raise ValueError("Data Matrix can only encode latin-1 characters")
+
+    for size, data_length, ecc_length, blocks in DATAMATRIX_SIZES:
+        if len(codewords) <= data_length:
+            break
+    else:
+        raise ValueError("Too much data for a Data Matrix")
+
+    # pad the data codewords, all pads but the first one are randomized
+    if len(codewords) < data_length:
+        codewords.append(129)
+    while len(codewords) < data_length:
+        pad = 129 + ((149 * (len(codewords) + 1)) % 253) + 1
+        codewords.append(pad - 254 if pad > 254 else pad)
+
+    # the error correction is computed on interleaved blocks, in the 144x144
+    # symbol the first 8 blocks get 156 data codewords and the last 2 get 155
+    ecc = [0] * ecc_length
+    for block in range(blocks):
+        block_ecc = _reed_solomon(codewords[block::blocks], ecc_length // blocks)
+        for i, value in enumerate(block_ecc):
+            ecc[block + i * blocks] = value
+    codewords += ecc
+
+    regions = 1 if size <= 26 else 2 if size <= 52 else 4 if size <= 104 else 6
+    region_size = (size - 2 * regions) // regions
+    placement = _datamatrix_placement(region_size * regions, region_size * regions)
+
+    matrix = [[0] * size for _ in range(size)]
+    for row in range(size):
+        for col in range(size):
+            region_row, region_col = row % (region_size + 2), col % (region_size + 2)
+            if region_col == 0 or region_row == region_size + 1:
+                # solid finder pattern on the left and bottom edge
+                matrix[row][col] = 1
+            elif region_row == 0:
+                matrix[row][col] = 1 - region_col % 2
+            elif region_col == region_size + 1:
+                matrix[row][col] = region_row % 2
+            else:
+                entry = placement[row - 1 - 2 * (row // (region_size + 2))][
+                    col - 1 - 2 * (col // (region_size + 2))]
+                if isinstance(entry, tuple):
+                    index, bit = entry
+                    matrix[row][col] = (codewords[index] >> (7 - bit)) & 1
+                else:
+                    matrix[row][col] = entry
+    return matrix
+
+
+ENCODERS = {
+    'code128': encode_code128,
+    'ean13': encode_ean13,
+    'datamatrix': encode_datamatrix,
+}
+
+
+def get_quiet_zone(symbology, module_width):
+    """ :return: width of the wider quiet zone of the symbology in dots """
+    return max(QUIET_ZONES[symbology]) * module_width
+
+
+def encode(symbology, data):
+    """ encodes data with the given symbology and adds the quiet zone
+    :param symbology: one of 'code128', 'ean13' or 'datamatrix'
+    :param data: the text to encode
+    :return: the rows of modules including the quiet zone
+    """
+    try:
+        encoder = ENCODERS[symbology]
+    except KeyError:
+        raise LookupError("Unknown barcode type")
+
+    rows = encoder(data)
+    left, right = QUIET_ZONES[symbology]
+    rows = [[0] * left + row + [0] * right for row in rows]
+    if len(rows) > 1:
+        # 2D symbols need the quiet zone on all sides
+        blank = [0] * len(rows[0])
+        rows = [blank] * left + rows + [blank] * right
+    return rows
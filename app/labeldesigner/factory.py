@@ -0,0 +1,305 @@
+"""
+Creates labels and printer queues from request-like values.
+
+This is shared by the web API and the command line interface, so it must
+not depend on Flask.
+"""
+
+import os
+import re
+import json
+
+from PIL import Image
+
+from brother_ql.devicedependent import label_type_specs
+from brother_ql.devicedependent import ENDLESS_LABEL, DIE_CUT_LABEL
+
+from .label import SimpleLabel, LabelContent, LabelOrientation, LabelType, BarcodeType, TextAlign
+from .printer import PrinterQueue
+from .imposition import Imposition
+from .template import LabelTemplate, TemplateField, TemplateLabel, FieldType
+
+# Don't change as brother_ql is using this DPI value
+DEFAULT_DPI = 300
+
+TEMPLATE_NAME = re.compile(r'^[A-Za-z0-9_-]+$')
+
+# template name -> (modification time of the file, LabelTemplate)
+_templates = {}
+
+
+def get_label_spec(label_size):
+    try:
+        return label_type_specs[label_size]
+    except KeyError:
+        raise LookupError("Unknown label_size")
+
+
+def get_label_geometry(label_size, label_orientation):
+    """ gets the type and the size of a label as it's drawn
+    :return: tuple of the LabelType, width and height, the height is 0 for endless labels
+    """
+    label_spec = get_label_spec(label_size)
+    if label_spec['kind'] == ENDLESS_LABEL:
+        label_type = LabelType.ENDLESS_LABEL
+    elif label_spec['kind'] == DIE_CUT_LABEL:
+        label_type = LabelType.DIE_CUT_LABEL
+    else:
+        label_type = LabelType.ROUND_DIE_CUT_LABEL
+
+    width, height = label_spec['dots_printable']
+    if height > width:
+        width, height = height, width
+    if label_orientation == LabelOrientation.ROTATED:
+        height, width = width, height
+    return label_type, width, height
+
+
+def get_font_path(fonts, config, font_family_name, font_style_name):
+    try:
+        if font_family_name is None or font_style_name is None:
+            font_family_name = config['LABEL_DEFAULT_FONT_FAMILY']
+            font_style_name = config['LABEL_DEFAULT_FONT_STYLE']
+        font_path = fonts.fonts[font_family_name][font_style_name]
+    except KeyError:
+        raise LookupError("Couln't find the font & style")
+    return font_path
+
+
+def create_printer_from_values(d, config, label_size=None):
+    """ creates a printer queue
+    :param d: dict-like with the print parameters (label_size, impose, ...)
+    :param config: the application configuration
+    :param label_size: overrides the label_size of the parameters, e.g. with the one of a template
+    """
+    context = {
+        'label_size': label_size or d.get('label_size', '62'),
+        'impose': int(d.get('impose', 0)) == 1,
+        'impose_gutter': int(d.get('impose_gutter', config['IMPOSITION_DEFAULT_GUTTER'])),
+        'cut_marks': int(d.get('cut_marks', 0)) == 1,
+    }
+
+    if context['impose']:
+        imposition = Imposition(
+            gutter = context['impose_gutter'],
+            cut_marks = context['cut_marks'],
+            max_length = config['IMPOSITION_MAX_LENGTH']
+        )
+    else:
+        imposition = None
+
+    return PrinterQueue(
+        model = config['PRINTER_MODEL'],
+        device_specifier = config['PRINTER_PRINTER'],
+        label_size = context['label_size'],
+        imposition = imposition,
+        status_timeout = config['PRINTER_STATUS_TIMEOUT']
+    )
+
+
+def create_label_from_values(d, config, fonts, image=None):
+    """ creates a label
+    :param d: dict-like with the label parameters (text, print_type, font_size, ...)
+    :param config: the application configuration
+    :param fonts: the Fonts available for the label
+    :param image: the already converted image for image labels
+    """
+    context={
+        'label_size': d.get('label_size', '62'),
+        'print_type': d.get('print_type', 'text'),
+        'label_orientation': d.get('orientation', 'standard'),
+        'margin_top': float(d.get('margin_top', 24))/100.,
+        'margin_bottom': float(d.get('margin_bottom', 45))/100.,
+        'margin_left': float(d.get('margin_left', 35))/100.,
+        'margin_right': float(d.get('margin_right', 35))/100.,
+        'text': d.get('text', None),
+        'align': d.get('align', 'center'),
+        'qrcode_size': int(d.get('qrcode_size', 10)),
+        'qrcode_correction': d.get('qrcode_correction', 'L'),
+        'barcode_type': d.get('barcode_type', 'code128'),
+        'barcode_module_width': int(d.get('barcode_module_width', 3)),
+        'barcode_height': int(d.get('barcode_height', 120)),
+        'image_mode': d.get('image_mode', "grayscale"),
+        'font_size': d.get('font_size', 100),
+        'text_wrap': int(d.get('text_wrap', 0)) == 1,
+        'line_spacing': int(d.get('line_spacing', 100)),
+        'font_family': d.get('font_family'),
+        'font_style': d.get('font_style'),
+        'print_color': d.get('print_color', 'black'),
+    }
+
+    if context['print_type'] == 'text':
+        label_content = LabelContent.TEXT_ONLY
+    elif context['print_type'] == 'qrcode':
+        label_content = LabelContent.QRCODE_ONLY
+    elif context['print_type'] == 'qrcode_text':
+        label_content = LabelContent.TEXT_QRCODE
+    elif context['print_type'] == 'barcode':
+        label_content = LabelContent.BARCODE_ONLY
+    elif context['print_type'] == 'barcode_text':
+        label_content = LabelContent.TEXT_BARCODE
+    elif context['image_mode'] == 'grayscale':
+        label_content = LabelContent.IMAGE_GRAYSCALE
+    elif context['image_mode'] == 'red_black':
+        label_content = LabelContent.IMAGE_RED_BLACK
+    elif context['image_mode'] == 'colored':
+        label_content = LabelContent.IMAGE_COLORED
+    else:
+        label_content = LabelContent.IMAGE_BW
+
+    try:
+        barcode_type = BarcodeType(context['barcode_type'])
+    except ValueError:
+        raise LookupError("Unknown barcode_type")
+
+    # the margins are relative to the font size, so the default size is used for them when fitting
+    auto_font_size = context['font_size'] == 'auto'
+    if auto_font_size:
+        context['font_size'] = config['LABEL_DEFAULT_FONT_SIZE']
+    else:
+        context['font_size'] = int(context['font_size'])
+
+    if context['barcode_module_width'] < 1:
+        raise ValueError("barcode_module_width has to be at least one dot")
+
+    if context['label_orientation'] == 'rotated':
+        label_orientation = LabelOrientation.ROTATED
+    else:
+        label_orientation = LabelOrientation.STANDARD
+
+    label_type, width, height = get_label_geometry(context['label_size'], label_orientation)
+
+    return SimpleLabel(
+        width=width,
+        height=height,
+        label_content=label_content,
+        label_orientation=label_orientation,
+        label_type=label_type,
+        label_margin=(
+            int(context['font_size']*context['margin_left']),
+            int(context['font_size']*context['margin_right']),
+            int(context['font_size']*context['margin_top']),
+            int(context['font_size']*context['margin_bottom'])
+        ),
+        fore_color=
+            (255, 0, 0) if 'red' in context['label_size'] and context['print_color'] == 'red'
+            else (0, 0, 0),
+        text=context['text'],
+        text_align=context['align'],
+        qr_size=context['qrcode_size'],
+        qr_correction=context['qrcode_correction'],
+        barcode_type=barcode_type,
+        barcode_module_width=context['barcode_module_width'],
+        barcode_height=context['barcode_height'],
+        image=image,
+        font_path=get_font_path(fonts, config, context['font_family'], context['font_style']),
+        font_size=context['font_size'],
+        auto_font_size=auto_font_size,
+        text_wrap=context['text_wrap'],
+        line_spacing=context['line_spacing'],
+        fallback_fonts=fonts
+    )
+
+
+def create_template_from_values(d, config, fonts, folder='.'):
+    """ creates a label template
+    :param d: the template definition, see the README for the format
+    :param config: the application configuration
+    :param fonts: the Fonts available for the template
+    :param folder: folder the image files are relative to
+    """
+    label_size = d.get('label_size', '62')
+    if d.get('orientation', 'standard') == 'rotated':
+        label_orientation = LabelOrientation.ROTATED
+    else:
+        label_orientation = LabelOrientation.STANDARD
+
+    label_type, width, height = get_label_geometry(label_size, label_orientation)
+    # the length of endless labels is fixed by the template
+    if label_type == LabelType.ENDLESS_LABEL:
+        if label_orientation == LabelOrientation.STANDARD:
+            height = int(d['length'])
+        else:
+            width = int(d['length'])
+
+    fore_color = (255, 0, 0) if 'red' in label_size and d.get('color', 'black') == 'red' else (0, 0, 0)
+
+    images = []
+    for item in d.get('images', []):
+        image = Image.open(os.path.join(folder, item['file'])).convert('RGB')
+        if 'width' in item:
+            image = image.resize((int(item['width']), int(image.height * int(item['width']) / image.width)))
+        # Template labels are thresholded when they are rasterized, dithering would spread
+        # the error across the raster rows which are cached. So the images are dithered once here.
+        image = image.convert('1').convert('RGB')
+        images.append((image, (int(item['x']), int(item['y']))))
+
+    def create_field(item, name=None):
+        try:
+            field_type = FieldType(item.get('type', 'text'))
+            barcode_type = BarcodeType(item.get('barcode_type', 'code128'))
+            align = TextAlign(item.get('align', 'left'))
+        except ValueError:
+            raise LookupError("Unknown type, barcode_type or align of a template field")
+        return TemplateField(
+            box=(int(item['x']), int(item['y']),
+                 int(item['x']) + int(item['width']), int(item['y']) + int(item['height'])),
+            field_type=field_type,
+            name=name,
+            text=item.get('text', ''),
+            font_path=get_font_path(fonts, config, item.get('font_family'), item.get('font_style')),
+            font_size=int(item.get('font_size', config['LABEL_DEFAULT_FONT_SIZE'])),
+            align=align,
+            barcode_type=barcode_type,
+            module_width=int(item.get('module_width', config['LABEL_DEFAULT_BARCODE_MODULE_WIDTH'])),
+            fallback_fonts=fonts)
+
+    return LabelTemplate(
+        width=width,
+        height=height,
+        label_size=label_size,
+        label_type=label_type,
+        label_orientation=label_orientation,
+        fore_color=fore_color,
+        images=images,
+        texts=[create_field(item) for item in d.get('texts', [])],
+        fields=[create_field(item, item['name']) for item in d.get('fields', [])],
+        frame=int(d.get('frame', 0)))
+
+
+def get_template(name, config, fonts):
+    """ loads a template from the TEMPLATE_FOLDER
+    The template, its background and raster data are kept until the file changes.
+    :param name: file name of the template without the .json extension
+    """
+    if not TEMPLATE_NAME.match(name):
+        raise LookupError("Unknown template")
+    filename = os.path.join(config['TEMPLATE_FOLDER'], name + '.json')
+    try:
+        mtime = os.path.getmtime(filename)
+    except OSError:
+        raise LookupError("Unknown template")
+
+    cached = _templates.get(name)
+    if cached is None or cached[0] != mtime:
+        with open(filename) as f:
+            template = create_template_from_values(json.load(f), config, fonts, config['TEMPLATE_FOLDER'])
+        cached = _templates[name] = (mtime, template)
+    return cached[1]
+
+
+def create_template_labels_from_values(d, config, fonts):
+    """ creates the labels of a serialized run
+    :param d: dict-like with the name of the template and the values of the fields
+     as a JSON list with one object per label (or a single object)
+    :return: list of TemplateLabel instances
+    """
+    template = get_template(d['template'], config, fonts)
+    values = d.get('values', '{}')
+    if isinstance(values, str):
+        values = json.loads(values)
+    if isinstance(values, dict):
+        values = [values]
+    if not values:
+        raise ValueError("No values for the labels of the template")
+    return [TemplateLabel(template, item) for item in values]
@@ -0,0 +1,148 @@
+"""
+N-up imposition of several small labels on an endless roll.
+
+The labels are trimmed to their content and packed into shelves (rows)
+across the printable width of the tape. Packed pages are printed as one
+raster job, so many small tags share feeds and cuts.
+"""
+
+from PIL import Image, ImageChops, ImageDraw
+
+CUT_MARK_DASH = 6
+CUT_MARK_WIDTH = 2
+
+
+def trim(image, keep=()):
+    """ crops the white border around the content of a label
+    :param image: the generated label
+    :param keep: boxes which stay on the cropped image, like the quiet zones of barcodes
+    :return: the cropped image (the image itself if it's blank)
+    """
+    image = image.convert('RGB')
+    background = Image.new('RGB', image.size, 'white')
+    bbox = ImageChops.difference(image, background).getbbox()
+    for box in keep:
+        if bbox is None:
+            bbox = box
+        else:
+            bbox = (min(bbox[0], box[0]), min(bbox[1], box[1]), max(bbox[2], box[2]), max(bbox[3], box[3]))
+    if bbox is None:
+        return image
+    return image.crop(bbox)
+
+
+def shelf_pack(sizes, width, gutter):
+    """ packs rectangles into shelves using first fit decreasing height
+    :param sizes: list of (width, height) tuples
+    :param width: width available for every shelf
+    :param gutter: space between the rectangles and between the shelves
+    :return: list of shelves, each a list of (index, x) tuples, and the shelf heights
+    """
+    shelves = []
+    heights = []
+    used = []
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i][1], reverse=True)
+    for index in order:
+        item_width, item_height = sizes[index]
+        if item_width > width:
+            raise ValueError("A label is wider than the tape")
+        for shelf, shelf_used in enumerate(used):
+            if shelf_used + gutter + item_width <= width:
+                shelves[shelf].append((index, shelf_used + gutter))
+                used[shelf] = shelf_used + gutter + item_width
+                break
+        else:
+            shelves.append([(index, 0)])
+            heights.append(item_height)
+            used.append(item_width)
+    return shelves, heights
+
+
+def _dashed_line(draw, start, end):
+    (x0, y0), (x1, y1) = start, end
+    if x0 == x1:
+        for y in range(y0, y1, 2 * CUT_MARK_DASH):
+            draw.line((x0, y, x0, min(y + CUT_MARK_DASH, y1)), fill='black', width=CUT_MARK_WIDTH)
+    else:
+        for x in range(x0, x1, 2 * CUT_MARK_DASH):
+            draw.line((x, y0, min(x + CUT_MARK_DASH, x1), y0), fill='black', width=CUT_MARK_WIDTH)
+
+
+class Imposition:
+    def __init__(self, gutter=24, cut_marks=False, max_length=0):
+        """
+        :param gutter: space between the labels in dots
+        :param cut_marks: draw dashed lines in the middle of the gutters
+        :param max_length: start a new page after this many dots, 0 for a single page
+        """
+        self.gutter = gutter
+        self.cut_marks = cut_marks
+        self.max_length = max_length
+
+    def impose(self, images, width, keep=None):
+        return impose(images, width, self.gutter, self.cut_marks, self.max_length, keep)
+
+    def split(self, images, width, keep=None):
+        return split(images, width, self.gutter, self.max_length, keep)
+
+
+def _paginate(shelves, heights, gutter, max_length):
+    """ splits the shelves into pages
+    :return: list of pages, each a list of (shelf, height) tuples
+    """
+    pages = [[]]
+    length = 0
+    for shelf, height in zip(shelves, heights):
+        if pages[-1] and max_length and length + gutter + height > max_length:
+            pages.append([])
+            length = 0
+        length += height if not pages[-1] else gutter + height
+        pages[-1].append((shelf, height))
+    return pages
+
+
+def _trim_all(images, keep):
+    if keep is None:
+        keep = [()] * len(images)
+    return [trim(image, boxes) for image, boxes in zip(images, keep)]
+
+
+def split(images, width, gutter=24, max_length=0, keep=None):
+    """ finds the labels impose() puts on every page
+    Imposing the labels of some pages on their own gives the same pages again.
+    :return: list of pages, each a sorted list of indices into images
+    """
+    shelves, heights = shelf_pack([item.size for item in _trim_all(images, keep)], width, gutter)
+    return [sorted(index for shelf, height in page for index, x in shelf)
+            for page in _paginate(shelves, heights, gutter, max_length)]
+
+
+def impose(images, width, gutter=24, cut_marks=False, max_length=0, keep=None):
+    """ packs several labels onto pages as wide as the tape
+    :param images: the labels as they should appear on the tape
+    :param width: printable width of the tape in dots
+    :param gutter: space between the labels in dots
+    :param cut_marks: draw dashed lines in the middle of the gutters
+    :param max_length: start a new page after this many dots, 0 for a single page
+    :param keep: for every image the boxes trim() has to keep
+    :return: list of the packed pages
+    """
+    items = _trim_all(images, keep)
+    shelves, heights = shelf_pack([item.size for item in items], width, gutter)
+
+    results = []
+    for page in _paginate(shelves, heights, gutter, max_length):
+        page_height = sum(height for shelf, height in page) + gutter * (len(page) - 1)
+        canvas = Image.new('RGB', (width, page_height), 'white')
+        draw = ImageDraw.Draw(canvas)
+        y = 0
+        for row, (shelf, height) in enumerate(page):
+            for column, (index, x) in enumerate(shelf):
+                canvas.paste(items[index], (x, y))
+                if cut_marks and column > 0:
+                    _dashed_line(draw, (x - gutter // 2, y), (x - gutter // 2, y + height))
+            if cut_marks and row > 0:
+                _dashed_line(draw, (0, y - gutter // 2), (width, y - gutter // 2))
+            y += height + gutter
+        results.append(canvas)
+    return results
@@ -1,7 +1,9 @@
 from enum import Enum, auto
-from qrcode import QRCode, constants
+from functools import lru_cache
 from PIL import Image, ImageDraw, ImageFont
 
+from . import barcode
+
 
 class LabelContent(Enum):
     TEXT_ONLY = auto()
@@ -11,6 +13,9 @@ class LabelContent(Enum):
     IMAGE_GRAYSCALE = auto()
     IMAGE_RED_BLACK = auto()
     IMAGE_COLORED = auto()
+    BARCODE_ONLY = auto()
+    TEXT_BARCODE = auto()
+    TEMPLATE = auto()
 
 
 class LabelOrientation(Enum):
@@ -24,18 +29,58 @@ class LabelType(Enum):
     ROUND_DIE_CUT_LABEL = auto()
 
 
+class BarcodeType(Enum):
+    CODE128 = 'code128'
+    EAN13 = 'ean13'
+    DATAMATRIX = 'datamatrix'
+
+
 class TextAlign(Enum):
     LEFT = 'left'
     CENTER = 'center'
     RIGHT = 'right'
 
 
+# font size at which SimpleLabel._fit_text() measures the text
+FIT_REFERENCE_FONT_SIZE = 200
+
+
+@lru_cache(maxsize=256)
+def get_font(font_path, font_size):
+    return ImageFont.truetype(font_path, font_size)
+
+
+def draw_modules(draw, offset, modules, module_width, row_height, fill):
+    """ draws barcode modules, every module being exactly module_width dots wide
+    :param draw: ImageDraw of the label
+    :param offset: position of the top left module
+    :param modules: rows of dark (1) and light (0) modules
+    :param row_height: height of every row in dots
+    :param fill: color of the dark modules
+    """
+    # runs of dark modules are drawn as single rectangles
+    x_offset, y_offset = offset
+    for row_index, row in enumerate(modules):
+        y = y_offset + row_index * row_height
+        start = None
+        for col, dark in enumerate(row + [0]):
+            if dark and start is None:
+                start = col
+            elif not dark and start is not None:
+                draw.rectangle(
+                    (x_offset + start * module_width, y,
+                     x_offset + col * module_width - 1, y + row_height - 1),
+                    fill=fill)
+                start = None
+
+
 class SimpleLabel:
+    # qrcode is imported when a QR code is generated
     qr_correction_mapping = {
-        'L': constants.ERROR_CORRECT_L,
-        'M': constants.ERROR_CORRECT_M,
-        'Q': constants.ERROR_CORRECT_Q,
-        'H': constants.ERROR_CORRECT_H
+        'L': 'ERROR_CORRECT_L',
+        'M': 'ERROR_CORRECT_M',
+        'Q': 'ERROR_CORRECT_Q',
+        'H': 'ERROR_CORRECT_H'
     }
 
     def __init__(
@@ -51,11 +96,17 @@ class SimpleLabel:
             text_align=TextAlign.CENTER,
             qr_size=10,
             qr_correction='L',
+            barcode_type=BarcodeType.CODE128,
+            barcode_module_width=3,
+            barcode_height=120,
             image_mode='grayscale',
             image=None,
             font_path='',
             font_size=70,
-            line_spacing=100):
+            auto_font_size=False,
+            text_wrap=False,
+            line_spacing=100,
+            fallback_fonts=None):
         self._width = width
         self._height = height
         self.label_content = label_content
@@ -67,15 +118,31 @@ class SimpleLabel:
         self._text_align = text_align
         self._qr_size = qr_size
         self.qr_correction = qr_correction
+        self._barcode_type = barcode_type
+        self._barcode_module_width = barcode_module_width
+        self._barcode_height = barcode_height
         self._image = image
         self._font_path = font_path
         self._font_size = font_size
+        self._auto_font_size = auto_font_size
+        self._text_wrap = text_wrap
         self._line_spacing = line_spacing
+        self._fallback_fonts = fallback_fonts
+        # (font size, text) found by _fit_text() if auto_font_size is set
+        self._fitted = None
+        self._barcode_boxes = []
 
     @property
     def label_content(self):
         return self._label_content
 
+    @property
+    def barcode_boxes(self):
+        """ the barcodes on the last generated label
+        :return: list of (box, quiet zone) tuples, the box includes the quiet zone, both in dots
+        """
+        return self._barcode_boxes
+
     @label_content.setter
     def label_content(self, value):
         self._label_content = value
@@ -90,14 +157,11 @@ class SimpleLabel:
 
     @property
     def qr_correction(self):
-        for key, val in self.qr_correction_mapping:
-            if val == self._qr_correction:
-                return key
+        return self._qr_correction
 
     @qr_correction.setter
     def qr_correction(self, value):
-        self._qr_correction = self.qr_correction_mapping.get(
-            value, constants.ERROR_CORRECT_L)
+        self._qr_correction = value if value in self.qr_correction_mapping else 'L'
 
     @property
     def label_orientation(self):
@@ -116,8 +180,12 @@ class SimpleLabel:
         self._label_type = value
 
     def generate(self):
+        barcode_modules = None
         if self._label_content in (LabelContent.QRCODE_ONLY, LabelContent.TEXT_QRCODE):
             img = self._generate_qr()
+        elif self._label_content in (LabelContent.BARCODE_ONLY, LabelContent.TEXT_BARCODE):
+            barcode_modules = self._generate_barcode()
+            img = None
         elif self._label_content in (LabelContent.IMAGE_BW, LabelContent.IMAGE_GRAYSCALE, LabelContent.IMAGE_RED_BLACK, LabelContent.IMAGE_COLORED):
             img = self._image
         else:
@@ -125,16 +193,37 @@ class SimpleLabel:
 
         if img is not None:
             img_width, img_height = img.size
+        elif barcode_modules is not None:
+            img_width, img_height = self._get_barcode_size(barcode_modules)
+            self._check_barcode_size(img_width, img_height, len(barcode_modules) > 1)
         else:
             img_width, img_height = (0, 0)
 
-        if self._label_content in (LabelContent.TEXT_ONLY, LabelContent.TEXT_QRCODE):
-            textsize = self._get_text_size()
+        margin_left, margin_right, margin_top, margin_bottom = self._label_margin
+
+        text_layout = None
+        self._fitted = None
+        if self._label_content in (LabelContent.TEXT_ONLY, LabelContent.TEXT_QRCODE, LabelContent.TEXT_BARCODE):
+            if self._auto_font_size:
+                if self._label_orientation == LabelOrientation.STANDARD:
+                    max_width = self._width - margin_left - margin_right
+                    if self._label_type in (LabelType.ENDLESS_LABEL,):
+                        max_height = None
+                    else:
+                        max_height = self._height - margin_top - margin_bottom - img_height
+                else:
+                    max_height = self._height - margin_top - margin_bottom
+                    if self._label_type in (LabelType.ENDLESS_LABEL,):
+                        max_width = None
+                    else:
+                        max_width = self._width - margin_left - margin_right - img_width
+                self._fitted = self._fit_text(max_width, max_height)
+            text_layout = self._get_text_layout()
+            textsize = self._get_text_size(text_layout)
         else:
             textsize = (0, 0, 0, 0)
 
         width, height = self._width, self._height
-        margin_left, margin_right, margin_top, margin_bottom = self._label_margin
 
         if self._label_orientation == LabelOrientation.STANDARD:
             if self._label_type in (LabelType.ENDLESS_LABEL,):
@@ -174,22 +263,40 @@ class SimpleLabel:
         if img is not None:
             imgResult.paste(img, image_offset)
 
-        if self._label_content in (LabelContent.TEXT_ONLY, LabelContent.TEXT_QRCODE):
-            draw = ImageDraw.Draw(imgResult)
+        draw = ImageDraw.Draw(imgResult)
+
+        self._barcode_boxes = []
+        if barcode_modules is not None:
+            self._draw_barcode(draw, image_offset, barcode_modules)
+            self._barcode_boxes.append((
+                (image_offset[0], image_offset[1], image_offset[0] + img_width, image_offset[1] + img_height),
+                barcode.get_quiet_zone(self._barcode_type.value, self._barcode_module_width)))
+
+        if text_layout is not None:
+            for (x, y), run, font in text_layout:
+                draw.text(
+                    (text_offset[0] + x, text_offset[1] + y),
+                    run,
+                    self._fore_color,
+                    font=font,
+                    anchor='ls')
+        elif self._label_content in (LabelContent.TEXT_ONLY, LabelContent.TEXT_QRCODE, LabelContent.TEXT_BARCODE):
             draw.multiline_text(
                 text_offset,
-                self._prepare_text(self._text),
+                self._prepare_text(self._get_text()),
                 self._fore_color,
                 font=self._get_font(),
-                align=self._text_align,
-                spacing=int(self._font_size*((self._line_spacing - 100) / 100)))
+                align=self._get_text_align(),
+                spacing=self._get_line_spacing())
 
         return imgResult
 
     def _generate_qr(self):
+        from qrcode import QRCode, constants
+
         qr = QRCode(
             version=1,
-            error_correction=self._qr_correction,
+            error_correction=getattr(constants, self.qr_correction_mapping[self._qr_correction]),
             box_size=self._qr_size,
             border=0,
         )
@@ -200,16 +307,180 @@ class SimpleLabel:
             back_color="white")
         return qr_img
 
-    def _get_text_size(self):
+    def _generate_barcode(self):
+        return barcode.encode(self._barcode_type.value, self._text)
+
+    def _get_barcode_size(self, modules):
+        width = len(modules[0]) * self._barcode_module_width
+        if len(modules) == 1:
+            height = self._barcode_height
+        else:
+            height = len(modules) * self._barcode_module_width
+        return width, height
+
+    def _check_barcode_size(self, width, height, two_dimensional):
+        # a clipped barcode doesn't scan, only endless labels grow with their content
+        endless = self._label_type == LabelType.ENDLESS_LABEL
+        if not (endless and self._label_orientation == LabelOrientation.ROTATED) and width > self._width:
+            raise ValueError(
+                "barcode is {} dots wide, label has {}; reduce barcode_module_width".format(width, self._width))
+        if not (endless and self._label_orientation == LabelOrientation.STANDARD) and height > self._height:
+            raise ValueError(
+                "barcode is {} dots high, label has {}; reduce {}".format(
+                    height, self._height, 'barcode_module_width' if two_dimensional else 'barcode_height'))
+
+    def _draw_barcode(self, draw, offset, modules):
+        if len(modules) == 1:
+            row_height = self._barcode_height
+        else:
+            row_height = self._barcode_module_width
+        draw_modules(draw, offset, modules, self._barcode_module_width, row_height, self._fore_color)
+
+    def _get_text_size(self, text_layout=None):
+        if text_layout is not None:
+            boxes = []
+            for (x, y), run, font in text_layout:
+                left, top, right, bottom = font.getbbox(run, anchor='ls')
+                boxes.append((left + x, top + y, right + x, bottom + y))
+            return (
+                min(box[0] for box in boxes),
+                min(box[1] for box in boxes),
+                max(box[2] for box in boxes),
+                max(box[3] for box in boxes))
+
         font = self._get_font()
         img = Image.new('L', (20, 20), 'white')
         draw = ImageDraw.Draw(img)
         return draw.multiline_textbbox(
             (0, 0),
-            self._prepare_text(self._text),
+            self._prepare_text(self._get_text()),
             font=font,
-            align=self._text_align,
-            spacing=int(self._font_size*((self._line_spacing - 100) / 100)))
+            align=self._get_text_align(),
+            spacing=self._get_line_spacing())
+
+    def _get_text_layout(self):
+        """ splits the text into runs of fonts which have glyphs for its characters
+        :return: list of ((x, y), text, font) tuples with the baseline position of
+        every run or None if the selected font covers the whole text
+        """
+        if self._fallback_fonts is None:
+            return None
+
+        lines = [self._fallback_fonts.split_runs(line, self._font_path)
+                 for line in self._prepare_text(self._get_text()).split('\n')]
+        if all(len(runs) == 1 and runs[0][1] == self._font_path for runs in lines):
+            return None
+
+        # mimic the line placement of ImageDraw.multiline_text()
+        font = self._get_font()
+        line_height = font.getbbox('A')[3] + self._get_line_spacing()
+        ascent = font.getmetrics()[0]
+        lines = [[(run, get_font(font_path, self._get_font_size())) for run, font_path in runs]
+                 for runs in lines]
+        widths = [sum(run_font.getlength(run) for run, run_font in runs) for runs in lines]
+        max_width = max(widths)
+
+        text_layout = []
+        for index, (runs, line_width) in enumerate(zip(lines, widths)):
+            if self._get_text_align() == 'right':
+                x = max_width - line_width
+            elif self._get_text_align() == 'center':
+                x = (max_width - line_width) / 2
+            else:
+                x = 0
+            y = index * line_height + ascent
+            for run, run_font in runs:
+                text_layout.append(((x, y), run, run_font))
+                x += run_font.getlength(run)
+        return text_layout
+
+    def _get_text_align(self):
+        if isinstance(self._text_align, TextAlign):
+            return self._text_align.value
+        return self._text_align
+
+    def _get_line_spacing(self):
+        return int(self._get_font_size()*((self._line_spacing - 100) / 100))
+
+    def _get_font_size(self):
+        if self._fitted is not None:
+            return self._fitted[0]
+        return self._font_size
+
+    def _get_text(self):
+        if self._fitted is not None:
+            return self._fitted[1]
+        return self._text
+
+    def _fit_text(self, max_width, max_height):
+        """ binary searches the largest font size for which the text fits into the area
+        :param max_width: available width in dots or None if unlimited
+        :param max_height: available height in dots or None if unlimited
+        :return: tuple of the font size and the (wrapped) text
+        """
+        # Text extents scale linearly with the font size apart from hinting,
+        # so the search runs on metrics measured once at a reference size
+        # and only the result is checked with the exact metrics.
+        reference_font = get_font(self._font_path, FIT_REFERENCE_FONT_SIZE)
+        reference_lengths = {}
+        reference_sizes = {}
+
+        def measure(font_size, text):
+            self._fitted = (font_size, text)
+            return self._get_text_size(self._get_text_layout())
+
+        def layout(font_size):
+            # Wrapping only makes the text narrower, so with an unlimited
+            # length the font would grow until every word is on its own line.
+            if self._text_wrap and max_width is not None and max_height is not None:
+                scale = font_size / FIT_REFERENCE_FONT_SIZE
+
+                def text_length(text):
+                    if text not in reference_lengths:
+                        reference_lengths[text] = reference_font.getlength(text)
+                    return reference_lengths[text] * scale
+
+                text = self._wrap_text(text_length, max_width)
+            else:
+                text = self._text
+            if text not in reference_sizes:
+                reference_sizes[text] = measure(FIT_REFERENCE_FONT_SIZE, text)
+            textsize = [value * font_size / FIT_REFERENCE_FONT_SIZE for value in reference_sizes[text]]
+            return text, textsize
+
+        def fits(textsize):
+            return ((max_width is None or textsize[2] <= max_width) and
+                    (max_height is None or textsize[3] <= max_height))
+
+        # the font size can't exceed the limited dimension of the label
+        limit = min(size for size in (max_width, max_height) if size is not None)
+        low, high = 1, max(int(limit), 1)
+        while low < high:
+            probe = (low + high + 1) // 2
+            if fits(layout(probe)[1]):
+                low = probe
+            else:
+                high = probe - 1
+
+        text = layout(low)[0]
+        while low > 1 and not fits(measure(low, text)):
+            low -= 1
+            text = layout(low)[0]
+        return low, text
+
+    def _wrap_text(self, text_length, max_width):
+        lines = []
+        for paragraph in self._text.split('\n'):
+            line = ''
+            for word in paragraph.split(' '):
+                candidate = word if line == '' else line + ' ' + word
+                if line != '' and text_length(candidate) > max_width:
+                    lines.append(line)
+                    line = word
+                else:
+                    line = candidate
+            lines.append(line)
+        return '\n'.join(lines)
 
     @staticmethod
     def _prepare_text(text):
@@ -223,4 +494,4 @@ class SimpleLabel:
         return '\n'.join(lines)
 
     def _get_font(self):
-        return ImageFont.truetype(self._font_path, self._font_size)
+        return get_font(self._font_path, self._get_font_size())
@@ -1,21 +1,35 @@
+import os
+import time
+
 from brother_ql.backends import backend_factory, guess_backend
+from brother_ql.reader import interpret_response
 from brother_ql import BrotherQLRaster, create_label
+from brother_ql.devicedependent import label_type_specs, ENDLESS_LABEL
+from app.profiling import stage
 from .label import LabelOrientation, LabelType, LabelContent
+from .template import TemplateLabel
 
 
 class PrinterQueue:
 
-    _printQueue = []
-    _cutQueue = []
-
     def __init__(
             self,
             model,
             device_specifier,
-            label_size):
+            label_size,
+            imposition=None,
+            status_timeout=0):
+        """
+        :param status_timeout: seconds to wait for the printer to report its status after printing, 0 to not read it back
+        """
+        self._printQueue = []
+        # id(label) -> generated image, kept until the queue is rasterized
+        self._images = {}
         self.model = model
         self.device_specifier = device_specifier
         self.label_size = label_size
+        self.imposition = imposition
+        self.status_timeout = status_timeout
 
     @property
     def model(self):
@@ -32,9 +46,9 @@ class PrinterQueue:
     @device_specifier.setter
     def device_specifier(self, value):
         self._device_specifier = value
-        selected_backend = guess_backend(self._device_specifier)
+        self._backend_name = guess_backend(self._device_specifier)
         self._backend_class = backend_factory(
-            selected_backend)['backend_class']
+            self._backend_name)['backend_class']
 
     @property
     def label_size(self):
@@ -44,6 +58,22 @@ class PrinterQueue:
     def label_size(self, value):
         self._label_size = value
 
+    @property
+    def status_timeout(self):
+        return self._status_timeout
+
+    @status_timeout.setter
+    def status_timeout(self, value):
+        self._status_timeout = value
+
+    @property
+    def imposition(self):
+        return self._imposition
+
+    @imposition.setter
+    def imposition(self, value):
+        self._imposition = value
+
     def add_label_to_queue(self, label, count, cut_once=False):
         for cnt in range(0, count):
             cut = (cut_once == False) or (cut_once and cnt == count-1)
@@ -53,37 +83,214 @@ class PrinterQueue:
                  'cut': cut
                  })
 
-    def process_queue(self):
+    def add_labels_to_queue(self, labels, count, cut_once=False):
+        """ adds the labels of a serialized run
+        :param cut_once: only cut after the last copy of the last label
+        """
+        for index, label in enumerate(labels):
+            self.add_label_to_queue(label, count, cut_once)
+            if cut_once and index < len(labels) - 1:
+                self._printQueue[-1]['cut'] = False
+
+    @property
+    def queue_length(self):
+        return len(self._printQueue)
+
+    def split_queue(self, chunk_size):
+        """ splits the queued labels into printer queues of at most chunk_size labels
+        The chunks keep the cuts of the labels, see cut_at_end().
+        Imposed labels are split at page boundaries instead, a chunk holds at least one page.
+        :return: list of PrinterQueue instances
+        """
+        chunk_size = max(chunk_size, 1)
+        if self._imposition is not None:
+            groups = []
+            for page in self._split_pages():
+                if groups and len(groups[-1]) + len(page) <= chunk_size:
+                    groups[-1].extend(page)
+                else:
+                    groups.append(list(page))
+            # keep the order of the queue, so the chunks pack the same way
+            groups = [sorted(group) for group in groups]
+        else:
+            groups = [range(start, min(start + chunk_size, len(self._printQueue)))
+                      for start in range(0, len(self._printQueue), chunk_size)]
+
+        chunks = []
+        for group in groups:
+            chunk = PrinterQueue(self._model, self._device_specifier, self._label_size, self._imposition, self._status_timeout)
+            chunk._printQueue = [dict(self._printQueue[index]) for index in group]
+            chunk._images = {id(entry['label']): self._images[id(entry['label'])]
+                             for entry in chunk._printQueue if id(entry['label']) in self._images}
+            chunks.append(chunk)
+        return chunks
+
+    def ends_with_cut(self):
+        """ whether the tape is cut after the queued labels """
+        # every imposed page is cut
+        return self._imposition is not None or (bool(self._printQueue) and self._printQueue[-1]['cut'])
+
+    def cut_at_end(self):
+        """ cuts after the last queued label, e.g. before the labels of another job are printed """
+        if self._printQueue:
+            self._printQueue[-1]['cut'] = True
+
+    def _split_pages(self):
+        """ :return: list of the indices of the queued labels on every imposed page """
+        images, keep = self._get_imposed_images()
+        with stage('impose'):
+            return self._imposition.split(images, label_type_specs[self.label_size]['dots_printable'][0], keep)
+
+    def rasterize_queue(self):
+        """ converts the queued labels to printer instructions and clears the queue
+        :return: the raster data
+        """
+        return self._rasterize_queue()[0]
+
+    def _rasterize_queue(self):
         qlr = BrotherQLRaster(self._model)
 
+        if self._imposition is not None:
+            pages = self._rasterize_imposed(qlr)
+        else:
+            pages = self._rasterize(qlr)
+
+        self._printQueue.clear()
+        self._images.clear()
+        return qlr.data, pages
+
+    def process_queue(self):
+        """ prints the queued labels
+        :return: the last status reported by the printer or None if it wasn't read back
+        """
+        data, pages = self._rasterize_queue()
+
+        with stage('send'):
+            be = self._backend_class(self._device_specifier)
+            be.write(data)
+            status = self._read_status(be, pages)
+            be.dispose()
+            del be
+        return status
+
+    def _read_status(self, be, pages):
+        # like brother_ql.backends.helpers.send(), there's no read-back from network printers
+        if not self._status_timeout or self._backend_name == 'network':
+            return None
+        # neither from a file the raster data is written to
+        if os.path.isfile(self._device_specifier.replace('file://', '', 1)):
+            return None
+
+        status = None
+        start = time.monotonic()
+        while time.monotonic() - start < self._status_timeout:
+            data = be.read()
+            if not data:
+                time.sleep(0.005)
+                continue
+            try:
+                status = interpret_response(data)
+            except (NameError, ValueError):
+                # an incomplete or unknown response
+                continue
+            if status['status_type'] == 'Printing completed':
+                pages -= 1
+            if status['errors'] or status['status_type'] == 'Error occurred' or pages <= 0:
+                break
+        return status
+
+    def _generate_images(self):
+        # copies of a label share the same object, so it's only generated once
         for queue_entry in self._printQueue:
-            if queue_entry['label'].label_type == LabelType.ENDLESS_LABEL:
-                if queue_entry['label'].label_orientation == LabelOrientation.STANDARD:
-                    rotate = 0
-                else:
-                    rotate = 90
-            else:
-                rotate = 'auto'
+            yield queue_entry, self._generate_image(queue_entry['label'], self._images)
 
-            img = queue_entry['label'].generate()
+    @staticmethod
+    def _generate_image(label, images):
+        if id(label) not in images:
+            with stage('generate'):
+                images[id(label)] = label.generate()
+        return images[id(label)]
 
-            if queue_entry['label'].label_content == LabelContent.IMAGE_BW: 
-                dither = False
+    @staticmethod
+    def _get_rotation(label):
+        if label.label_type == LabelType.ENDLESS_LABEL:
+            if label.label_orientation == LabelOrientation.STANDARD:
+                return 0
             else:
-                dither = True
+                return 90
+        else:
+            return 'auto'
+
+    @staticmethod
+    def _use_dither(label):
+        return label.label_content not in (LabelContent.IMAGE_BW, LabelContent.BARCODE_ONLY, LabelContent.TEXT_BARCODE, LabelContent.TEMPLATE)
 
+    def _rasterize(self, qlr):
+        for queue_entry in self._printQueue:
+            label = queue_entry['label']
+            if isinstance(label, TemplateLabel) and label.template.can_rasterize(self.label_size):
+                # only the rows with the fields of the label are rasterized
+                with stage('raster'):
+                    qlr.data += label.template.rasterize(self._model, label.values, queue_entry['cut'])
+                continue
+
+            img = self._generate_image(label, self._images)
+            with stage('raster'):
+                create_label(
+                    qlr,
+                    img,
+                    self.label_size,
+                    red='red' in self.label_size,
+                    dither=self._use_dither(queue_entry['label']),
+                    cut=queue_entry['cut'],
+                    rotate=self._get_rotation(queue_entry['label']))
+        return len(self._printQueue)
+
+    def impose_queue(self):
+        """ packs the queued labels onto pages as wide as the endless tape
+        :return: list of the packed pages
+        """
+        images, keep = self._get_imposed_images()
+        with stage('impose'):
+            return self._imposition.impose(images, label_type_specs[self.label_size]['dots_printable'][0], keep)
+
+    def _get_imposed_images(self):
+        """ :return: the labels as they appear on the tape and the barcode boxes trimming has to keep """
+        if label_type_specs[self.label_size]['kind'] != ENDLESS_LABEL:
+            raise ValueError("N-up printing needs an endless label")
+
+        images = []
+        keep = []
+        for queue_entry, img in self._generate_images():
+            barcodes = queue_entry['label'].barcode_boxes
+            for box, quiet_zone in barcodes:
+                # cutting along the marks by hand strays, a gutter as wide as a quiet zone leaves room for it
+                if self._imposition.cut_marks and self._imposition.gutter < quiet_zone:
+                    raise ValueError(
+                        "gutter is {} dots, the barcode quiet zone {}; increase impose_gutter".format(
+                            self._imposition.gutter, quiet_zone))
+            boxes = [box for box, quiet_zone in barcodes]
+            rotate = self._get_rotation(queue_entry['label'])
+            if rotate:
+                # rotate the same way brother_ql does, so the labels appear as they are printed
+                boxes = [(top, img.width - right, bottom, img.width - left) for left, top, right, bottom in boxes]
+                img = img.rotate(rotate, expand=True)
+            images.append(img)
+            keep.append(boxes)
+        return images, keep
+
+    def _rasterize_imposed(self, qlr):
+        pages = self.impose_queue()
+        dither = any(self._use_dither(queue_entry['label']) for queue_entry in self._printQueue)
+
+        with stage('raster'):
+            # all pages go into a single raster job, every page is cut
             create_label(
                 qlr,
-                img,
+                pages,
                 self.label_size,
                 red='red' in self.label_size,
                 dither=dither,
-                cut=queue_entry['cut'],
-                rotate=rotate)
-
-        self._printQueue.clear()
-
-        be = self._backend_class(self._device_specifier)
-        be.write(qlr.data)
-        be.dispose()
-        del be
+                cut=True,
+                rotate=0)
+        return len(pages)
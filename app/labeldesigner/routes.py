@@ -3,25 +3,31 @@ import os
 from flask import current_app, render_template, request, make_response
 
 from brother_ql.devicedependent import label_type_specs, label_sizes, two_color_support
-from brother_ql.devicedependent import ENDLESS_LABEL, DIE_CUT_LABEL, ROUND_DIE_CUT_LABEL
+from brother_ql.devicedependent import ROUND_DIE_CUT_LABEL, ENDLESS_LABEL
 
 from . import bp
-from app.utils import convert_image_to_bw, convert_image_to_grayscale, convert_image_to_red_and_black, pdffile_to_image, imgfile_to_image, image_to_png_bytes
-from app import FONTS
+from app.utils import convert_image, convert_image_to_bw, convert_image_to_grayscale, pdffile_to_image, imgfile_to_image, image_to_png_bytes
+from app import FONTS, EVENTS, PRINT_SCHEDULER
+from app.scheduler import PrintJob, JobPriority
+from app.profiling import stage
 
-from .label import SimpleLabel, LabelContent, LabelOrientation, LabelType
-from .printer import PrinterQueue
+from .label import BarcodeType, LabelType
+from .factory import create_label_from_values, create_printer_from_values, create_template_labels_from_values, DEFAULT_DPI
 
 LINE_SPACINGS = (100, 150, 200, 250, 300)
 
-# Don't change as brother_ql is using this DPI value
-DEFAULT_DPI = 300
+BARCODE_TYPES = (
+    (BarcodeType.CODE128.value, 'Code 128'),
+    (BarcodeType.EAN13.value, 'EAN-13'),
+    (BarcodeType.DATAMATRIX.value, 'Data Matrix'),
+)
 
 LABEL_SIZES = [(
     name,
     label_type_specs[name]['name'],
     (label_type_specs[name]['kind'] in (
-        ROUND_DIE_CUT_LABEL,))  # True if round label
+        ROUND_DIE_CUT_LABEL,)),  # True if round label
+    label_type_specs[name]['kind'] == ENDLESS_LABEL  # True if endless label
 ) for name in label_sizes]
 
 
@@ -36,12 +42,17 @@ def index():
                            default_font_size=current_app.config['LABEL_DEFAULT_FONT_SIZE'],
                            default_orientation=current_app.config['LABEL_DEFAULT_ORIENTATION'],
                            default_qr_size=current_app.config['LABEL_DEFAULT_QR_SIZE'],
+                           barcode_types=BARCODE_TYPES,
+                           default_barcode_type=current_app.config['LABEL_DEFAULT_BARCODE_TYPE'],
+                           default_barcode_module_width=current_app.config['LABEL_DEFAULT_BARCODE_MODULE_WIDTH'],
+                           default_barcode_height=current_app.config['LABEL_DEFAULT_BARCODE_HEIGHT'],
                            default_image_mode=current_app.config['IMAGE_DEFAULT_MODE'],
                            default_bw_threshold=current_app.config['IMAGE_DEFAULT_BW_THRESHOLD'],
                            default_font_family=current_app.config['LABEL_DEFAULT_FONT_FAMILY'],
                            line_spacings=LINE_SPACINGS,
                            default_line_spacing=current_app.config['LABEL_DEFAULT_LINE_SPACING'],
                            default_dpi=DEFAULT_DPI,
+                           default_impose_gutter=current_app.config['IMPOSITION_DEFAULT_GUTTER'],
                            default_margin_top=current_app.config['LABEL_DEFAULT_MARGIN_TOP'],
                            default_margin_bottom=current_app.config['LABEL_DEFAULT_MARGIN_BOTTOM'],
                            default_margin_left=current_app.config['LABEL_DEFAULT_MARGIN_LEFT'],
@@ -58,18 +69,38 @@ def get_font_styles():
 
 @bp.route('/api/preview', methods=['POST', 'GET'])
 def get_preview_from_image():
-    label = create_label_from_request(request)
-    im = label.generate()
+    try:
+        with stage('create_label'):
+            labels = create_labels_from_request(request)
+        label = labels[0]
+        # labels are only packed on endless rolls, else the single label is shown
+        if int(request.values.get('impose', 0)) == 1 and label.label_type == LabelType.ENDLESS_LABEL:
+            # preview the first page of the packed labels
+            printer = create_printer_from_request(request, label)
+            printer.add_labels_to_queue(labels, int(request.values.get('print_count', 1)))
+            im = printer.impose_queue()[0]
+        else:
+            with stage('generate'):
+                im = label.generate()
+    except (ValueError, LookupError) as e:
+        # e.g. a barcode which doesn't fit onto the label
+        response = make_response(str(e), 400)
+        response.headers.set('Content-type', 'text/plain')
+        return response
 
     return_format = request.values.get('return_format', 'png')
 
     if return_format == 'base64':
         import base64
-        response = make_response(base64.b64encode(image_to_png_bytes(im)))
+        with stage('encode'):
+            data = base64.b64encode(image_to_png_bytes(im))
+        response = make_response(data)
         response.headers.set('Content-type', 'text/plain')
         return response
     else:
-        response = make_response(image_to_png_bytes(im))
+        with stage('encode'):
+            data = image_to_png_bytes(im)
+        response = make_response(data)
         response.headers.set('Content-type', 'image/png')
         return response
 
@@ -88,19 +119,29 @@ def print_text():
     return_dict = {'success': False}
 
     try:
-        printer = create_printer_from_request(request)
-        label = create_label_from_request(request)
+        with stage('create_label'):
+            labels = create_labels_from_request(request)
+        printer = create_printer_from_request(request, labels[0])
         print_count = int(request.values.get('print_count', 1))
+        if print_count < 1:
+            raise ValueError("print_count has to be at least 1")
         cut_once = int(request.values.get('cut_once', 0)) == 1
+        priority = get_priority_from_request(request, print_count * len(labels))
     except Exception as e:
         return_dict['message'] = str(e)
         current_app.logger.error('Exception happened: %s', e)
         return return_dict
 
-    printer.add_label_to_queue(label, print_count, cut_once)
+    printer.add_labels_to_queue(labels, print_count, cut_once)
 
     try:
-        printer.process_queue()
+        job = PrintJob(
+            printer,
+            priority=priority,
+            client=request.values.get('client', request.remote_addr),
+            chunk_size=current_app.config['PRINT_QUEUE_CHUNK_SIZE'],
+            tag=request.values.get('tag'))
+        PRINT_SCHEDULER.submit(job).wait()
     except Exception as e:
         return_dict['message'] = str(e)
         current_app.logger.error('Exception happened: %s', e)
@@ -110,138 +151,86 @@ def print_text():
     return return_dict
 
 
-def create_printer_from_request(request):
-    d = request.values
-    context = {
-        'label_size': d.get('label_size', '62')
-    }
+@bp.route('/api/queue', methods=['GET'])
+def get_queue_status():
+    """
+    API to get the state of the print queue
 
-    return PrinterQueue(
-        model = current_app.config['PRINTER_MODEL'],
-        device_specifier = current_app.config['PRINTER_PRINTER'],
-        label_size = context['label_size']
-    )
+    returns: JSON with the queued jobs and waiting times in seconds per priority class
+    """
+    return PRINT_SCHEDULER.status()
 
 
-def create_label_from_request(request):
-    d=request.values
-    context={
-        'label_size': d.get('label_size', '62'),
-        'print_type': d.get('print_type', 'text'),
-        'label_orientation': d.get('orientation', 'standard'),
-        'kind': label_type_specs[d.get('label_size', "62")]['kind'],
-        'margin_top': float(d.get('margin_top', 24))/100.,
-        'margin_bottom': float(d.get('margin_bottom', 45))/100.,
-        'margin_left': float(d.get('margin_left', 35))/100.,
-        'margin_right': float(d.get('margin_right', 35))/100.,
-        'text': d.get('text', None),
-        'align': d.get('align', 'center'),
-        'qrcode_size': int(d.get('qrcode_size', 10)),
-        'qrcode_correction': d.get('qrcode_correction', 'L'),
-        'image_mode': d.get('image_mode', "grayscale"),
-        'image_bw_threshold': int(d.get('image_bw_threshold', 70)),
-        'font_size': int(d.get('font_size', 100)),
-        'line_spacing': int(d.get('line_spacing', 100)),
-        'font_family': d.get('font_family'),
-        'font_style': d.get('font_style'),
-        'print_color': d.get('print_color', 'black'),
-    }
-
-    def get_label_dimensions(label_size):
-        try:
-            ls = label_type_specs[context['label_size']]
-        except KeyError:
-            raise LookupError("Unknown label_size")
-        return ls['dots_printable']
-
-    def get_font_path(font_family_name, font_style_name):
-        try:
-            if font_family_name is None or font_style_name is None:
-                font_family_name = current_app.config['LABEL_DEFAULT_FONT_FAMILY']
-                font_style_name = current_app.config['LABEL_DEFAULT_FONT_STYLE']
-            font_path = FONTS.fonts[font_family_name][font_style_name]
-        except KeyError:
-            raise LookupError("Couln't find the font & style")
-        return font_path
-
-    def get_uploaded_image(image):
-        try:
-            name, ext = os.path.splitext(image.filename)
-            if ext.lower() in ('.png', '.jpg', '.jpeg'):
-                image = imgfile_to_image(image)
-                if context['image_mode'] == 'grayscale':
-                    return convert_image_to_grayscale(image)
-                elif context['image_mode'] == 'red_and_black':
-                    return convert_image_to_red_and_black(image)
-                elif context['image_mode'] == 'colored':
-                    return image
-                else:
-                    return convert_image_to_bw(image, context['image_bw_threshold'])
-            elif ext.lower() in ('.pdf'):
-                image = pdffile_to_image(image, DEFAULT_DPI)
-                if context['image_mode'] == 'grayscale':
-                    return convert_image_to_grayscale(image)
-                else:
-                    return convert_image_to_bw(image, context['image_bw_threshold'])
-            else:
-                return None
-        except AttributeError:
-            return None
+@bp.route('/api/events', methods=['GET'])
+def get_events():
+    """
+    API streaming Server-Sent Events to the client
 
-    if context['print_type'] == 'text':
-        label_content = LabelContent.TEXT_ONLY
-    elif context['print_type'] == 'qrcode':
-        label_content = LabelContent.QRCODE_ONLY
-    elif context['print_type'] == 'qrcode_text':
-        label_content = LabelContent.TEXT_QRCODE
-    elif context['image_mode'] == 'grayscale':
-        label_content = LabelContent.IMAGE_GRAYSCALE
-    elif context['image_mode'] == 'red_black':
-        label_content = LabelContent.IMAGE_RED_BLACK
-    elif context['image_mode'] == 'colored':
-        label_content = LabelContent.IMAGE_COLORED
-    else:
-        label_content = LabelContent.IMAGE_BW
+    events: 'job' (state changes of the print jobs), 'queue' (like /api/queue)
+    and 'printer' (the status read back from the printer)
+    """
+    stream = EVENTS.stream(request.headers.get('Last-Event-ID'), current_app.config['EVENTS_KEEPALIVE'])
+    if stream is None:
+        response = current_app.response_class('Too many event streams are open', status=503, mimetype='text/plain')
+        response.headers['Retry-After'] = 60
+        return response
 
-    if context['label_orientation'] == 'rotated':
-        label_orientation = LabelOrientation.ROTATED
-    else:
-        label_orientation = LabelOrientation.STANDARD
+    response = current_app.response_class(stream, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # don't let nginx buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
-    if context['kind'] == ENDLESS_LABEL:
-        label_type = LabelType.ENDLESS_LABEL
-    elif context['kind'] == DIE_CUT_LABEL:
-        label_type = LabelType.DIE_CUT_LABEL
-    else:
-        label_type = LabelType.ROUND_DIE_CUT_LABEL
-
-    width, height = get_label_dimensions(context['label_size'])
-    if height > width:
-        width, height = height, width
-    if label_orientation == LabelOrientation.ROTATED:
-        height, width = width, height
-
-    return SimpleLabel(
-        width=width,
-        height=height,
-        label_content=label_content,
-        label_orientation=label_orientation,
-        label_type=label_type,
-        label_margin=(
-            int(context['font_size']*context['margin_left']),
-            int(context['font_size']*context['margin_right']),
-            int(context['font_size']*context['margin_top']),
-            int(context['font_size']*context['margin_bottom'])
-        ),
-        fore_color=
-            (255, 0, 0) if 'red' in context['label_size'] and context['print_color'] == 'red'
-            else (0, 0, 0),
-        text=context['text'],
-        text_align=context['align'],
-        qr_size=context['qrcode_size'],
-        qr_correction=context['qrcode_correction'],
-        image=get_uploaded_image(request.files.get('image', None)),
-        font_path=get_font_path(context['font_family'], context['font_style']),
-        font_size=context['font_size'],
-        line_spacing=context['line_spacing']
-    )
+
+def get_priority_from_request(request, print_count):
+    priority = request.values.get('priority')
+    if priority is None:
+        if print_count >= current_app.config['PRINT_QUEUE_BULK_THRESHOLD']:
+            return JobPriority.BULK
+        return JobPriority.INTERACTIVE
+    try:
+        return JobPriority(priority)
+    except ValueError:
+        raise LookupError("Unknown priority")
+
+
+def create_printer_from_request(request, label=None):
+    # template labels are printed on the label size of their template
+    template = getattr(label, 'template', None)
+    return create_printer_from_values(
+        request.values, current_app.config,
+        label_size=template.label_size if template is not None else None)
+
+
+def create_labels_from_request(request):
+    """ creates the labels of a serialized run if a template is given, else a single label
+    """
+    if request.values.get('template'):
+        return create_template_labels_from_values(request.values, current_app.config, FONTS)
+    return [create_label_from_request(request)]
+
+
+def create_label_from_request(request):
+    d = request.values
+    image = get_uploaded_image(
+        request.files.get('image', None),
+        d.get('image_mode', "grayscale"),
+        int(d.get('image_bw_threshold', 70)))
+    return create_label_from_values(d, current_app.config, FONTS, image=image)
+
+
+def get_uploaded_image(image, image_mode, image_bw_threshold):
+    try:
+        name, ext = os.path.splitext(image.filename)
+        if ext.lower() in ('.png', '.jpg', '.jpeg'):
+            return convert_image(imgfile_to_image(image), image_mode, image_bw_threshold)
+        elif ext.lower() in ('.pdf'):
+            image = pdffile_to_image(image, DEFAULT_DPI)
+            if image_mode == 'grayscale':
+                return convert_image_to_grayscale(image)
+            else:
+                return convert_image_to_bw(image, image_bw_threshold)
+        else:
+            return None
+    except AttributeError:
+        return None
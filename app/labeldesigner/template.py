@@ -0,0 +1,352 @@
+"""
+Labels with a fixed layout in which only a few fields change.
+
+The static layers of a template (images, fixed texts and the frame) are
+drawn once and cached. A label of a serialized run only draws its variable
+fields into the boxes they occupy. On endless labels the raster rows of the
+background are cached as well and only the rows crossing the boxes of the
+fields are rasterized again, so the cost of every label is proportional to
+the changed area instead of the whole label.
+"""
+
+from enum import Enum
+from PIL import Image, ImageDraw
+
+from brother_ql import BrotherQLRaster, create_label
+from brother_ql.devicedependent import label_type_specs, ENDLESS_LABEL
+
+from . import barcode
+from .label import LabelContent, LabelOrientation, LabelType, BarcodeType, TextAlign, get_font, draw_modules
+
+
+class FieldType(Enum):
+    TEXT = 'text'
+    BARCODE = 'barcode'
+    QRCODE = 'qrcode'
+
+
+class TemplateField:
+    def __init__(
+            self,
+            box,
+            field_type=FieldType.TEXT,
+            name=None,
+            text='',
+            font_path='',
+            font_size=70,
+            align=TextAlign.LEFT,
+            barcode_type=BarcodeType.CODE128,
+            module_width=3,
+            fallback_fonts=None):
+        """
+        :param box: (left, top, right, bottom) of the area on the label, anything outside is cut off
+        :param field_type: one of the FieldType values
+        :param name: name of the value drawn into the box, None for a fixed text
+        :param text: the fixed text or the default if the value is missing
+        :param align: horizontal alignment inside the box
+        :param module_width: width of the barcode and QR code modules in dots
+        :param fallback_fonts: Fonts used for characters missing in the font
+        """
+        self.box = box
+        self.field_type = field_type
+        self.name = name
+        self.text = text
+        self.font_path = font_path
+        self.font_size = font_size
+        self.align = align
+        self.barcode_type = barcode_type
+        self.module_width = module_width
+        self.fallback_fonts = fallback_fonts
+
+    def get_value(self, values):
+        if self.name is None:
+            return self.text
+        return str(values.get(self.name, self.text))
+
+    def check(self, value):
+        """ raises a ValueError if the barcode or QR code of the value doesn't fit into the box """
+        if value == '':
+            return
+        if self.field_type == FieldType.BARCODE:
+            self._get_barcode(value, self._get_size())
+        elif self.field_type == FieldType.QRCODE:
+            self._get_qrcode(value, (0, 0, 0), self._get_size())
+
+    def _get_size(self):
+        left, top, right, bottom = self.box
+        return right - left, bottom - top
+
+    def _check_size(self, kind, width, height, size):
+        # a clipped symbol doesn't scan
+        if width > size[0] or height > size[1]:
+            raise ValueError(
+                "{} of the field '{}' is {}x{} dots, its box {}x{}; reduce module_width or enlarge the box".format(
+                    kind, self.name or self.text, width, height, size[0], size[1]))
+
+    def draw(self, image, value, fore_color, offset=(0, 0)):
+        """ draws the value into the box of the field
+        :param image: image containing the whole box
+        :param offset: position of the image on the label
+        """
+        left, top, right, bottom = self.box
+        box = (left - offset[0], top - offset[1], right - offset[0], bottom - offset[1])
+        area = image.crop(box)
+        draw = ImageDraw.Draw(area)
+        if value == '':
+            pass
+        elif self.field_type == FieldType.BARCODE:
+            self._draw_barcode(draw, value, fore_color, area.size)
+        elif self.field_type == FieldType.QRCODE:
+            self._draw_qrcode(area, value, fore_color)
+        else:
+            self._draw_text(draw, value, fore_color, area.size)
+        image.paste(area, box[:2])
+
+    def _get_x(self, width, content_width):
+        if self.align == TextAlign.RIGHT:
+            return width - content_width
+        elif self.align == TextAlign.CENTER:
+            return (width - content_width) / 2
+        return 0
+
+    def _draw_text(self, draw, value, fore_color, size):
+        font = get_font(self.font_path, self.font_size)
+        if self.fallback_fonts is not None:
+            runs = [(run, get_font(font_path, self.font_size))
+                    for run, font_path in self.fallback_fonts.split_runs(value, self.font_path)]
+        else:
+            runs = [(value, font)]
+
+        # the baseline is placed so the line is centered vertically in the box
+        ascent, descent = font.getmetrics()
+        x = self._get_x(size[0], sum(run_font.getlength(run) for run, run_font in runs))
+        y = (size[1] + ascent - descent) // 2
+        for run, run_font in runs:
+            draw.text((x, y), run, fore_color, font=run_font, anchor='ls')
+            x += run_font.getlength(run)
+
+    def _get_barcode(self, value, size):
+        """ :return: the modules of the barcode including the quiet zone and the height of a row """
+        modules = barcode.encode(self.barcode_type.value, value)
+        if len(modules) == 1:
+            # linear barcodes fill the height of the box
+            row_height = size[1]
+        else:
+            row_height = self.module_width
+        self._check_size('barcode', len(modules[0]) * self.module_width, len(modules) * row_height, size)
+        return modules, row_height
+
+    def _draw_barcode(self, draw, value, fore_color, size):
+        modules, row_height = self._get_barcode(value, size)
+        x = self._get_x(size[0], len(modules[0]) * self.module_width)
+        y = (size[1] - len(modules) * row_height) // 2
+        draw_modules(draw, (int(x), y), modules, self.module_width, row_height, fore_color)
+
+    def _get_qrcode(self, value, fore_color, size):
+        from qrcode import QRCode, constants
+
+        qr = QRCode(
+            version=1,
+            error_correction=constants.ERROR_CORRECT_L,
+            box_size=self.module_width,
+            border=0,
+        )
+        qr.add_data(value.encode("utf-8-sig"))
+        qr.make(fit=True)
+        qr_img = qr.make_image(
+            fill_color='red' if (255, 0, 0) == fore_color else 'black',
+            back_color="white")
+        self._check_size('QR code', qr_img.size[0], qr_img.size[1], size)
+        return qr_img
+
+    def _draw_qrcode(self, area, value, fore_color):
+        qr_img = self._get_qrcode(value, fore_color, area.size)
+        width, height = area.size
+        area.paste(qr_img, (int(self._get_x(width, qr_img.size[0])), (height - qr_img.size[1]) // 2))
+
+
+class LabelTemplate:
+    def __init__(
+            self,
+            width,
+            height,
+            label_size,
+            label_type=LabelType.ENDLESS_LABEL,
+            label_orientation=LabelOrientation.STANDARD,
+            fore_color=(0, 0, 0),
+            images=(),
+            texts=(),
+            fields=(),
+            frame=0):
+        """
+        :param width: width of the label in dots
+        :param height: height of the label in dots
+        :param label_size: the label size the template is made for
+        :param images: list of (image, (x, y)) tuples drawn on the background
+        :param texts: TemplateField instances with a fixed text
+        :param fields: TemplateField instances drawn with the values of every label
+        :param frame: width of a frame around the label in dots, 0 for none
+        """
+        self.width = width
+        self.height = height
+        self.label_size = label_size
+        self.label_type = label_type
+        self.label_orientation = label_orientation
+        self._fore_color = fore_color
+        self._images = images
+        self._texts = texts
+        self.fields = fields
+        self._frame = frame
+        self._background = None
+        # (model, cut) -> (header, raster rows, trailer) of the background
+        self._rasters = {}
+
+        for field in list(texts) + list(fields):
+            left, top, right, bottom = field.box
+            if left < 0 or top < 0 or right > width or bottom > height or left >= right or top >= bottom:
+                raise ValueError("The box of a template field is outside of the label")
+        # the values of the other fields are checked when they are drawn
+        for text in texts:
+            text.check(text.text)
+
+    @property
+    def background(self):
+        """ the label with the static layers, drawn on first use """
+        if self._background is None:
+            self._background = self._draw_background()
+        return self._background
+
+    def _draw_background(self):
+        image = Image.new('RGB', (self.width, self.height), 'white')
+        for img, position in self._images:
+            image.paste(img, position)
+        draw = ImageDraw.Draw(image)
+        if self._frame:
+            draw.rectangle((0, 0, self.width - 1, self.height - 1), outline=self._fore_color, width=self._frame)
+        for text in self._texts:
+            text.draw(image, text.text, self._fore_color)
+        return image
+
+    def render(self, values, box=None):
+        """ draws the fields with the values onto a copy of the background
+        :param values: dict with the values of the fields
+        :param box: only render this part of the label, it must contain the fields it intersects
+        """
+        if box is None:
+            box = (0, 0, self.width, self.height)
+        image = self.background.crop(box)
+        for field in self.fields:
+            left, top, right, bottom = field.box
+            if left < box[2] and right > box[0] and top < box[3] and bottom > box[1]:
+                field.draw(image, field.get_value(values), self._fore_color, box[:2])
+        return image
+
+    @property
+    def barcode_boxes(self):
+        """ the barcode fields of the template
+        :return: list of (box, quiet zone) tuples, the box includes the quiet zone, both in dots
+        """
+        return [(field.box, barcode.get_quiet_zone(field.barcode_type.value, field.module_width))
+                for field in list(self._texts) + list(self.fields)
+                if field.field_type == FieldType.BARCODE]
+
+    def _get_rotation(self):
+        return 0 if self.label_orientation == LabelOrientation.STANDARD else 90
+
+    def _get_strips(self):
+        """ merges the extents of the fields along the feed direction
+        :return: list of (start, end) of the label parts containing fields
+        """
+        if self.label_orientation == LabelOrientation.STANDARD:
+            extents = sorted((field.box[1], field.box[3]) for field in self.fields)
+        else:
+            extents = sorted((field.box[0], field.box[2]) for field in self.fields)
+        strips = []
+        for start, end in extents:
+            if strips and start <= strips[-1][1]:
+                strips[-1] = (strips[-1][0], max(strips[-1][1], end))
+            else:
+                strips.append((start, end))
+        return strips
+
+    def can_rasterize(self, label_size):
+        """ whether rasterize() can be used, else the labels have to be rasterized as a whole
+        """
+        # Die cut labels have to be converted as a whole and red/black
+        # labels are split into two color planes.
+        return (label_size == self.label_size and 'red' not in label_size and
+                label_type_specs[label_size]['kind'] == ENDLESS_LABEL)
+
+    def _convert(self, model, image, cut):
+        """ rasterizes an image exactly like PrinterQueue does for template labels
+        :return: the raster data and the size of a raster row in bytes
+        """
+        qlr = BrotherQLRaster(model)
+        create_label(
+            qlr,
+            image,
+            self.label_size,
+            dither=False,
+            cut=cut,
+            rotate=self._get_rotation())
+        # every row is sent uncompressed as a 3 bytes command followed by the pixels
+        return qlr.data, 3 + qlr.get_pixel_width() // 8
+
+    def _get_raster(self, model, cut):
+        key = (model, cut)
+        if key not in self._rasters:
+            data, row_size = self._convert(model, self.background, cut)
+            # create_label() finishes the rows with the print command
+            count = self.height if self.label_orientation == LabelOrientation.STANDARD else self.width
+            start = len(data) - 1 - count * row_size
+            rows = [data[start + i * row_size:start + (i + 1) * row_size] for i in range(count)]
+            self._rasters[key] = (data[:start], rows, data[-1:])
+        return self._rasters[key]
+
+    def rasterize(self, model, values, cut=True):
+        """ converts a label to printer instructions, only rasterizing the rows with fields
+        :param model: the printer model
+        :param values: dict with the values of the fields
+        :param cut: cut after the label
+        :return: the raster data of the label
+        """
+        header, rows, trailer = self._get_raster(model, cut)
+        rows = list(rows)
+        for start, end in self._get_strips():
+            if self.label_orientation == LabelOrientation.STANDARD:
+                box = (0, start, self.width, end)
+                first = start
+            else:
+                # brother_ql rotates counterclockwise, so the last column becomes the first row
+                box = (start, 0, end, self.height)
+                first = self.width - end
+            data, row_size = self._convert(model, self.render(values, box), cut)
+            count = end - start
+            data = data[len(data) - 1 - count * row_size:-1]
+            rows[first:first + count] = [data[i * row_size:(i + 1) * row_size] for i in range(count)]
+        return header + b''.join(rows) + trailer
+
+
+class TemplateLabel:
+    """ a label of a serialized run, drawn from a template and the values of its fields """
+
+    label_content = LabelContent.TEMPLATE
+
+    def __init__(self, template, values):
+        self.template = template
+        self.values = values
+
+    @property
+    def label_type(self):
+        return self.template.label_type
+
+    @property
+    def label_orientation(self):
+        return self.template.label_orientation
+
+    @property
+    def barcode_boxes(self):
+        return self.template.barcode_boxes
+
+    def generate(self):
+        return self.template.render(self.values)
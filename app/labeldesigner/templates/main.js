@@ -5,7 +5,8 @@ function formData(cut_once) {
         text:        text,
         font_family: $('#fontFamily option:selected').text(),
         font_style:  $('#fontStyle option:selected').text(),
-        font_size:   $('#fontSize').val(),
+        font_size:   $('#fontSizeAuto').is(':checked') ? 'auto' : $('#fontSize').val(),
+        text_wrap:   $('#textWrap').is(':checked') ? 1 : 0,
         label_size:  $('#labelSize option:selected').val(),
         align:       $('input[name=fontAlign]:checked').val(),
         orientation: $('input[name=orientation]:checked').val(),
@@ -16,6 +17,9 @@ function formData(cut_once) {
         print_type:    $('input[name=printType]:checked').val(),
         qrcode_size:   $('#qrCodeSize').val(),
         qrcode_correction: $('#qrCodeCorrection option:selected').val(),
+        barcode_type:         $('#barcodeType option:selected').val(),
+        barcode_module_width: $('#barcodeModuleWidth').val(),
+        barcode_height:       $('#barcodeHeight').val(),
         image_bw_threshold: $('#imageBwThreshold').val(),
         image_mode:         $('input[name=imageMode]:checked').val(),
         print_count:       $('#printCount').val(),
@@ -24,6 +28,10 @@ function formData(cut_once) {
         {% endif %}
         line_spacing:      $('input[name=lineSpacing]:checked').val(),
         cut_once:          cut_once ? 1 : 0,
+        tag:               printTag,
+        impose:            $('#impose').is(':checked') && !$('#impose').prop('disabled') ? 1 : 0,
+        impose_gutter:     $('#imposeGutter').val(),
+        cut_marks:         $('#cutMarks').is(':checked') ? 1 : 0,
     }
 }
 
@@ -88,6 +96,17 @@ function preview() {
     }
     {% endif %}
 
+    // labels can only be packed onto endless rolls
+    var endless = $('#labelSize option:selected').data('endless') == 'True';
+    $('#impose').prop('disabled', !endless);
+    var impose = endless && $('#impose').is(':checked');
+    $('#cutMarks').prop('disabled', !impose);
+    $('#imposeGutter').prop('disabled', !impose);
+
+    $('#fontSize').prop('disabled', $('#fontSizeAuto').is(':checked'));
+    // the text only wraps if the length of the label is fixed
+    $('#textWrap').prop('disabled', !$('#fontSizeAuto').is(':checked') || endless);
+
     if($('input[name=printType]:checked').val() == 'image') {
         $('#groupLabelText').hide();
         $('#groupLabelImage').show()
@@ -109,11 +128,19 @@ function preview() {
         data:        formData(),
         success: function( data ) {
             updatePreview(data);
+        },
+        error: function( xhr ) {
+            $('#statusPanel').html('<div id="statusBox" class="alert alert-warning" role="alert"><i class="fas fa-exclamation-triangle"></i><span>Preview failed:<br />'+xhr.responseText+'</span></div>');
         }
     });
 }
 
+var printTag = null;
+var events = null;
+
 function setStatus(data) {
+    printTag = null;
+    unwatchJob();
     if (data['success']) {
         $('#statusPanel').html('<div id="statusBox" class="alert alert-success" role="alert"><i class="fas fa-check"></i><span>Printing was successful.</span></div>');
     } else {
@@ -123,7 +150,48 @@ function setStatus(data) {
     $('#dropdownPrintButton').prop('disabled', false);
 }
 
+function showJobProgress(job) {
+    // only the job of this page, the result is shown by setStatus()
+    if (job['tag'] != printTag || (job['state'] != 'queued' && job['state'] != 'printing')) return;
+    if (job['state'] == 'queued') {
+        var text = 'Waiting for the printer...';
+    } else {
+        var text = 'Printed ' + job['printed'] + ' of ' + job['labels'] + ' labels...';
+    }
+    $('#statusPanel').html('<div id="statusBox" class="alert alert-info" role="alert"><i class="fas fa-hourglass-half"></i><span>'+text+'</span></div>');
+}
+
+function showPrinterStatus(printer) {
+    var text = printer['model'] + ': ' + printer['media_width'] + 'mm ' + printer['media_type'];
+    if (printer['errors'].length > 0) {
+        text += ' - ' + printer['errors'].join(', ');
+    }
+    $('#printerStatus').text(text).toggleClass('text-danger', printer['errors'].length > 0);
+    $('#printerStatusFooter').show();
+}
+
+function watchJob() {
+    // the event stream is only open while a job of this page is printing
+    if (!window.EventSource || events !== null) return;
+    events = new EventSource('{{url_for('.get_events')}}');
+    events.addEventListener('job', function(e) {
+        showJobProgress(JSON.parse(e.data));
+    });
+    events.addEventListener('printer', function(e) {
+        showPrinterStatus(JSON.parse(e.data));
+    });
+}
+
+function unwatchJob() {
+    if (events !== null) {
+        events.close();
+        events = null;
+    }
+}
+
 function print(cut_once = false) {
+    printTag = Math.random().toString(36).substring(2);
+    watchJob();
     $('#printButton').prop('disabled', true);
     $('#dropdownPrintButton').prop('disabled', true);
     $('#statusPanel').html('<div id="statusBox" class="alert alert-info" role="alert"><i class="fas fa-hourglass-half"></i><span>Processing print request...</span></div>');
@@ -0,0 +1,170 @@
+"""
+Opt-in per-request profiling.
+
+If PROFILE_ENABLED is set, a request carrying the X-Profile header or the
+profile query parameter is run under cProfile. The statistics are dumped
+as .pstats files to PROFILE_FOLDER (only the newest PROFILE_MAX_FILES are
+kept) and the time spent in the stages of the label pipeline is returned
+in a Server-Timing header. Work handed to another thread (the print
+scheduler) is measured there with resume() and merged into the request.
+
+When profiling is disabled no request hooks are registered and stage()
+only does a single attribute lookup.
+"""
+
+import os
+import time
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager, nullcontext
+
+_local = threading.local()
+_NULL_STAGE = nullcontext()
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+
+class _Stage:
+    def __init__(self, timings, name):
+        self._timings = timings
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self._start
+        self._timings[self._name] = self._timings.get(self._name, 0) + duration
+        return False
+
+
+def stage(name):
+    """ context manager measuring a stage of the current profiled request
+    :param name: name of the stage as reported in the Server-Timing header
+    """
+    timings = getattr(_local, 'timings', None)
+    if timings is None:
+        return _NULL_STAGE
+    return _Stage(timings, name)
+
+
+def current():
+    """ the profiling state of the current request, to be passed to resume()
+    :return: None if the request isn't profiled
+    """
+    timings = getattr(_local, 'timings', None)
+    if timings is None:
+        return None
+    return timings, _local.profiles
+
+
+@contextmanager
+def resume(state):
+    """ continues profiling a request in another thread
+    :param state: what current() returned in the thread of the request
+    """
+    if state is None:
+        yield
+        return
+
+    timings, profiles = state
+    _local.timings = timings
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        profiler = None
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiles.append(profiler)
+        _local.timings = None
+
+
+def _profiling_requested():
+    from flask import request
+
+    value = request.headers.get('X-Profile', request.args.get('profile', ''))
+    return value.lower() in TRUE_VALUES
+
+
+def _rotate(folder, max_files):
+    files = sorted(
+        (entry for entry in os.scandir(folder)
+         if entry.is_file() and entry.name.endswith('.pstats')),
+        key=lambda entry: entry.stat().st_mtime)
+    for entry in files[:max(len(files) - max_files, 0)]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def _server_timing(timings, total):
+    metrics = ['{};dur={:.2f}'.format(name, duration * 1000)
+               for name, duration in timings.items()]
+    metrics.append('total;dur={:.2f}'.format(total * 1000))
+    return ', '.join(metrics)
+
+
+def init_app(app):
+    if not app.config['PROFILE_ENABLED']:
+        return
+
+    from flask import request
+
+    folder = app.config['PROFILE_FOLDER']
+    max_files = app.config['PROFILE_MAX_FILES']
+    os.makedirs(folder, exist_ok=True)
+
+    @app.before_request
+    def start_profiling():
+        if not _profiling_requested():
+            return
+        _local.timings = {}
+        # profiles recorded by other threads working for this request
+        _local.profiles = []
+        _local.start = time.perf_counter()
+        _local.profiler = cProfile.Profile()
+        try:
+            _local.profiler.enable()
+        except ValueError:
+            # another request of this process is already being profiled
+            _local.profiler = None
+
+    @app.after_request
+    def stop_profiling(response):
+        timings = getattr(_local, 'timings', None)
+        if timings is None:
+            return response
+
+        total = time.perf_counter() - _local.start
+        profiles = _local.profiles
+        if _local.profiler is not None:
+            _local.profiler.disable()
+            profiles.insert(0, _local.profiler)
+        _local.timings = _local.profiler = _local.profiles = None
+
+        if profiles:
+            filename = '{:.6f}-{}.pstats'.format(
+                time.time(), request.endpoint or 'unknown')
+            try:
+                pstats.Stats(*profiles).dump_stats(os.path.join(folder, filename))
+                _rotate(folder, max_files)
+                response.headers['X-Profile-File'] = filename
+            except OSError as e:
+                app.logger.error('Could not write the profile: %s', e)
+
+        response.headers['Server-Timing'] = _server_timing(timings, total)
+        return response
+
+    @app.teardown_request
+    def cleanup_profiling(exc):
+        profiler = getattr(_local, 'profiler', None)
+        if profiler is not None:
+            profiler.disable()
+        _local.timings = _local.profiler = _local.profiles = None
@@ -0,0 +1,273 @@
+"""
+Priority and fair-share scheduling of print jobs.
+
+Jobs are split into chunks at label boundaries. A single worker thread
+sends the chunks to the printer: interactive jobs always go before bulk
+jobs and clients within the same class take turns chunk by chunk, so a
+short urgent job only waits for the chunk currently being printed.
+
+A chunk is only cut at its end if another job is printed next. Otherwise
+it keeps the cuts of its labels and the job goes on with its next chunk,
+so splitting a job doesn't add cuts (e.g. with cut_once).
+
+If a publisher is given, every change of a job, the queue depth and the
+status read back from the printer are published as events.
+"""
+
+import time
+import logging
+import itertools
+import threading
+from collections import OrderedDict, deque
+from enum import Enum
+
+from . import profiling
+
+logger = logging.getLogger(__name__)
+
+
+def _run_blocking(func, *args):
+    """ calls func(*args) in a native thread if gevent patched the threading module
+    Rasterizing and sending the labels would block every other connection of a gevent worker.
+    """
+    try:
+        from gevent import get_hub, monkey
+    except ImportError:
+        return func(*args)
+    if not monkey.is_module_patched('threading'):
+        return func(*args)
+    return get_hub().threadpool.apply(func, args)
+
+
+class JobPriority(Enum):
+    INTERACTIVE = 'interactive'
+    BULK = 'bulk'
+
+
+class JobState(Enum):
+    QUEUED = 'queued'
+    PRINTING = 'printing'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+class PrinterError(Exception):
+    pass
+
+
+class PrintJob:
+    _ids = itertools.count(1)
+
+    def __init__(self, printer, priority=JobPriority.INTERACTIVE, client=None, chunk_size=10, tag=None):
+        """
+        :param printer: PrinterQueue with the labels of the job
+        :param priority: the JobPriority of the job
+        :param client: identifies the client for sharing the printer fairly
+        :param chunk_size: maximum number of labels printed in one go
+        :param tag: chosen by the client to recognize its job in the events
+        """
+        self.id = next(self._ids)
+        self.priority = priority
+        self.client = client
+        self.tag = tag
+        self.labels = printer.queue_length
+        self.printed = 0
+        self.state = JobState.QUEUED
+        self._chunks = deque(printer.split_queue(chunk_size))
+        self.submitted = time.monotonic()
+        self.started = None
+        self.error = None
+        # the stages of a profiled request are measured by the worker as well
+        self.profile = profiling.current()
+        self._done = threading.Event()
+
+    def info(self):
+        return {
+            'id': self.id,
+            'tag': self.tag,
+            'state': self.state.value,
+            'priority': self.priority.value,
+            'labels': self.labels,
+            'printed': self.printed,
+            'message': str(self.error) if self.error is not None else None,
+        }
+
+    def wait(self, timeout=None):
+        """ blocks until the job is printed
+        :raise: the exception which made printing fail
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError("The print job didn't finish in time")
+        if self.error is not None:
+            raise self.error
+
+
+class PrintScheduler:
+    def __init__(self, publisher=None):
+        """
+        :param publisher: EventPublisher for the 'job', 'queue' and 'printer' events
+        """
+        self._publisher = publisher
+        self._condition = threading.Condition()
+        # priority -> client -> jobs of the client in submission order
+        self._queues = {priority: OrderedDict() for priority in JobPriority}
+        self._stats = {priority: {'jobs': 0, 'wait_total': 0.0, 'wait_max': 0.0} for priority in JobPriority}
+        self._worker = None
+        # job whose last chunk ended without a cut, it's continued before anything else
+        self._uncut = None
+
+    def submit(self, job):
+        with self._condition:
+            self._queues[job.priority].setdefault(job.client, deque()).append(job)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='print-scheduler', daemon=True)
+                self._worker.start()
+            self._condition.notify()
+        self._publish(job)
+        return job
+
+    def _publish(self, job, printer_status=None):
+        if self._publisher is None:
+            return
+        try:
+            self._send_events(job, printer_status)
+        except Exception:
+            # the events are informational, printing goes on without them
+            logger.exception('Publishing the state of print job %s failed', job.id)
+
+    def _send_events(self, job, printer_status):
+        self._publisher.publish('job', job.info())
+        self._publisher.publish('queue', self.status(), retain=True)
+        if printer_status is not None:
+            self._publisher.publish('printer', {
+                'model': printer_status['model'],
+                'media_type': printer_status['media_type'],
+                'media_width': printer_status['media_width'],
+                'media_length': printer_status['media_length'],
+                'status_type': printer_status['status_type'],
+                'phase_type': printer_status['phase_type'],
+                'errors': printer_status['errors'],
+            }, retain=True)
+
+    def status(self):
+        """ reports the queue depth and the waiting times of every class
+        :return: dict with the statistics per JobPriority value
+        """
+        now = time.monotonic()
+        with self._condition:
+            result = {}
+            for priority, clients in self._queues.items():
+                waiting = [job for jobs in clients.values() for job in jobs]
+                stats = self._stats[priority]
+                result[priority.value] = {
+                    'queued_jobs': len(waiting),
+                    'queued_clients': len(clients),
+                    'oldest_wait': max((now - job.submitted for job in waiting if job.started is None), default=0.0),
+                    'started_jobs': stats['jobs'],
+                    'average_wait': stats['wait_total'] / stats['jobs'] if stats['jobs'] else 0.0,
+                    'max_wait': stats['wait_max'],
+                }
+            return result
+
+    def _pick(self):
+        """ :return: the job the next chunk is taken from or None """
+        if self._uncut is not None and self._uncut._chunks:
+            return self._uncut
+        for priority in JobPriority:
+            clients = self._queues[priority]
+            if clients:
+                return next(iter(clients.values()))[0]
+        return None
+
+    def _next_chunk(self):
+        job = self._pick()
+        if job is None:
+            return None, None
+
+        # take turns: the client served now moves to the end of the line
+        clients = self._queues[job.priority]
+        jobs = clients[job.client]
+        clients.move_to_end(job.client)
+        # a job without labels is finished without printing anything
+        chunk = job._chunks.popleft() if job._chunks else None
+        if not job._chunks:
+            jobs.popleft()
+            if not jobs:
+                del clients[job.client]
+
+        self._uncut = None
+        if job._chunks:
+            if self._pick() is not job:
+                # cut before another job is printed
+                chunk.cut_at_end()
+            elif not chunk.ends_with_cut():
+                self._uncut = job
+
+        if job.started is None:
+            job.started = time.monotonic()
+            wait = job.started - job.submitted
+            stats = self._stats[job.priority]
+            stats['jobs'] += 1
+            stats['wait_total'] += wait
+            stats['wait_max'] = max(stats['wait_max'], wait)
+        return job, chunk
+
+    @staticmethod
+    def _process_chunk(job, chunk):
+        with profiling.resume(job.profile):
+            return chunk.process_queue()
+
+    def _drop(self, job):
+        jobs = self._queues[job.priority].get(job.client)
+        if jobs is not None and job in jobs:
+            jobs.remove(job)
+            if not jobs:
+                del self._queues[job.priority][job.client]
+        job._chunks.clear()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                job, chunk = self._next_chunk()
+                while job is None:
+                    self._condition.wait()
+                    job, chunk = self._next_chunk()
+
+            try:
+                self._print_chunk(job, chunk)
+            except Exception as e:
+                # a broken job mustn't stop the worker, every later job would hang
+                logger.exception('Print job %s failed', job.id)
+                if job.error is None:
+                    job.error = e
+                with self._condition:
+                    self._drop(job)
+                job.state = JobState.FAILED
+                job._done.set()
+
+    def _print_chunk(self, job, chunk):
+        if job.state == JobState.QUEUED:
+            job.state = JobState.PRINTING
+            self._publish(job)
+
+        printer_status = None
+        if chunk is not None:
+            labels = chunk.queue_length
+            try:
+                printer_status = _run_blocking(self._process_chunk, job, chunk)
+                if printer_status is not None and printer_status['errors']:
+                    raise PrinterError('The printer reported: ' + ', '.join(printer_status['errors']))
+                job.printed += labels
+            except Exception as e:
+                job.error = e
+                with self._condition:
+                    self._drop(job)
+
+        if job.error is not None:
+            job.state = JobState.FAILED
+        elif not job._chunks:
+            job.state = JobState.DONE
+        self._publish(job, printer_status)
+
+        if job.state in (JobState.DONE, JobState.FAILED):
+            job._done.set()
@@ -3,7 +3,6 @@
 from PIL import Image
 from PIL.ImageOps import colorize
 from io import BytesIO
-from pdf2image import convert_from_bytes
 
 
 def convert_image_to_bw(image, threshold):
@@ -17,6 +16,16 @@ def convert_image_to_grayscale(image):
 def convert_image_to_red_and_black(image):
     return colorize(image.convert('L'), black='black', white='white', mid='red')
 
+def convert_image(image, image_mode, threshold):
+    if image_mode == 'grayscale':
+        return convert_image_to_grayscale(image)
+    elif image_mode == 'red_and_black':
+        return convert_image_to_red_and_black(image)
+    elif image_mode == 'colored':
+        return image
+    else:
+        return convert_image_to_bw(image, threshold)
+
 
 def imgfile_to_image(file):
     s = BytesIO()
@@ -26,6 +35,9 @@ def imgfile_to_image(file):
 
 
 def pdffile_to_image(file, dpi):
+    # pdf2image is only needed for pdf uploads
+    from pdf2image import convert_from_bytes
+
     s = BytesIO()
     file.save(s)
     s.seek(0)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Renders and prints labels without starting the web service.
+
+Labels are read as JSON objects, one per line, from the given files or from
+stdin. They take the same parameters as /labeldesigner/api/print, e.g.
+{"text": "Hello", "font_size": 60, "label_size": "62", "print_count": 2}.
+Image labels take the path of a .png, .jpg or .pdf file as "image", the
+optional "name" is used for the output files. Serialized runs name a
+"template" and give the "values" of its fields as a list, e.g.
+{"template": "asset", "values": [{"serial": "0001"}, {"serial": "0002"}]}.
+"""
+
+import os
+import sys
+import json
+import argparse
+
+from config import Config, basedir
+
+
+def load_config():
+    """ reads the defaults and 'instance/application.py' like the web service
+    :return: dict with the settings
+    """
+    config = {key: getattr(Config, key) for key in dir(Config) if key.isupper()}
+    filename = os.path.join(basedir, 'instance', 'application.py')
+    if os.path.exists(filename):
+        values = {'__file__': filename}
+        with open(filename) as f:
+            exec(compile(f.read(), filename, 'exec'), values)
+        config.update({key: value for key, value in values.items() if key.isupper()})
+    return config
+
+
+def load_fonts(config, rescan=False):
+    """ loads the persisted font index and only scans the fonts if there is none
+    """
+    from app.fonts import Fonts
+
+    fonts = Fonts(config['LABEL_FALLBACK_FONT_FAMILIES'])
+    index = config['FONT_INDEX_FILE']
+    if index and os.path.exists(index) and not rescan:
+        fonts.load_index(index)
+        return fonts
+
+    fonts.scan_global_fonts()
+    if config['FONT_FOLDER']:
+        fonts.scan_fonts_folder(config['FONT_FOLDER'])
+    if index:
+        try:
+            os.makedirs(os.path.dirname(index), exist_ok=True)
+            fonts.save_index(index)
+        except OSError as e:
+            print('Could not write the font index: {}'.format(e), file=sys.stderr)
+    return fonts
+
+
+def load_image(spec):
+    from app.utils import convert_image, convert_image_to_bw, convert_image_to_grayscale
+    from app.labeldesigner.factory import DEFAULT_DPI
+
+    filename = spec.get('image')
+    if not filename:
+        return None
+    image_mode = spec.get('image_mode', 'grayscale')
+    threshold = int(spec.get('image_bw_threshold', 70))
+
+    if os.path.splitext(filename)[1].lower() == '.pdf':
+        from pdf2image import convert_from_path
+
+        image = convert_from_path(filename, dpi=DEFAULT_DPI)[0]
+        if image_mode == 'grayscale':
+            return convert_image_to_grayscale(image)
+        else:
+            return convert_image_to_bw(image, threshold)
+
+    from PIL import Image
+    return convert_image(Image.open(filename), image_mode, threshold)
+
+
+def read_specs(filenames):
+    """ yields the location and the content of every non-empty line
+    """
+    for filename in filenames or ['-']:
+        f = sys.stdin if filename == '-' else open(filename)
+        try:
+            for lineno, line in enumerate(f, start=1):
+                if line.strip():
+                    yield '{}:{}'.format(filename, lineno), line
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def process_spec(spec, name, args, config, fonts):
+    from app.labeldesigner.factory import create_label_from_values, create_printer_from_values, create_template_labels_from_values
+    from app.utils import image_to_png_bytes
+
+    if spec.get('template'):
+        labels = create_template_labels_from_values(spec, config, fonts)
+        printer = create_printer_from_values(spec, config, label_size=labels[0].template.label_size)
+    else:
+        labels = [create_label_from_values(spec, config, fonts, image=load_image(spec))]
+        printer = create_printer_from_values(spec, config)
+    printer.add_labels_to_queue(
+        labels, int(spec.get('print_count', 1)), int(spec.get('cut_once', 0)) == 1)
+
+    if args.output == 'png':
+        if printer.imposition is not None:
+            images = printer.impose_queue()
+        else:
+            images = [label.generate() for label in labels]
+        for page, image in enumerate(images):
+            suffix = '-{}'.format(page + 1) if len(images) > 1 else ''
+            with open(os.path.join(args.output_dir, name + suffix + '.png'), 'wb') as f:
+                f.write(image_to_png_bytes(image))
+    elif args.output == 'raster':
+        with open(os.path.join(args.output_dir, name + '.bin'), 'wb') as f:
+            f.write(printer.rasterize_queue())
+    else:
+        printer.process_queue()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*',
+                        help='Files with one JSON label per line, "-" or nothing to read stdin')
+    parser.add_argument('--output', default='png', choices=('png', 'raster', 'printer'),
+                        help='Write PNG images, raw raster files or print the labels (default: png)')
+    parser.add_argument('--output-dir', default='.',
+                        help='Folder for the PNG and raster files (default: current folder)')
+    parser.add_argument('--model', default=False,
+                        help='The model of your printer (default: PRINTER_MODEL setting)')
+    parser.add_argument('--printer', default=False,
+                        help='String descriptor for the printer to use (like tcp://192.168.0.23:9100 or file:///dev/usb/lp0)')
+    parser.add_argument('--rescan-fonts', action='store_true',
+                        help='Scan the fonts instead of using the persisted font index')
+    args = parser.parse_args()
+
+    config = load_config()
+    if args.model:
+        config['PRINTER_MODEL'] = args.model
+    if args.printer:
+        config['PRINTER_PRINTER'] = args.printer
+
+    fonts = load_fonts(config, args.rescan_fonts)
+    if not fonts.fonts_available():
+        print('Not a single font was found on your system. Please install some.', file=sys.stderr)
+        sys.exit(2)
+
+    family, style = config['LABEL_DEFAULT_FONT_FAMILY'], config['LABEL_DEFAULT_FONT_STYLE']
+    if style not in fonts.fonts.get(family, {}):
+        family = fonts.fontlist()[0]
+        config['LABEL_DEFAULT_FONT_FAMILY'] = family
+        config['LABEL_DEFAULT_FONT_STYLE'] = sorted(fonts.fonts[family])[0]
+
+    failed = False
+    for index, (location, line) in enumerate(read_specs(args.files), start=1):
+        try:
+            spec = json.loads(line)
+            name = str(spec.get('name', 'label-{:04d}'.format(index)))
+            process_spec(spec, name, args, config, fonts)
+        except Exception as e:
+            print('{}: {}'.format(location, e), file=sys.stderr)
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -17,11 +17,16 @@ class Config(object):
 
     PRINTER_MODEL = 'QL-500'
     PRINTER_PRINTER = 'file:///dev/usb/lp1'
+    # Seconds to wait for the printer to report its status after a print, 0 to not read it back
+    PRINTER_STATUS_TIMEOUT = 10
 
     LABEL_DEFAULT_ORIENTATION = 'standard'
     LABEL_DEFAULT_SIZE = '62'
     LABEL_DEFAULT_FONT_SIZE = 70
     LABEL_DEFAULT_QR_SIZE = 10
+    LABEL_DEFAULT_BARCODE_TYPE = 'code128'
+    LABEL_DEFAULT_BARCODE_MODULE_WIDTH = 3
+    LABEL_DEFAULT_BARCODE_HEIGHT = 120
     LABEL_DEFAULT_LINE_SPACING = 100
     LABEL_DEFAULT_FONT_FAMILY = 'DejaVu Serif'
     LABEL_DEFAULT_FONT_STYLE = 'Book'
@@ -34,4 +39,32 @@ class Config(object):
     LABEL_DEFAULT_MARGIN_LEFT = 35
     LABEL_DEFAULT_MARGIN_RIGHT = 35
 
+    # Jobs are printed in chunks of this many labels, so urgent jobs can go in between
+    PRINT_QUEUE_CHUNK_SIZE = 10
+    # Jobs with at least this many labels are scheduled as bulk jobs by default
+    PRINT_QUEUE_BULK_THRESHOLD = 20
+
+    # Seconds between keepalive comments on idle /api/events streams
+    EVENTS_KEEPALIVE = 15
+    # Safety limit for open /api/events streams, further clients get a 503.
+    # With a threaded server every stream holds a thread, so keep it below the threads.
+    EVENTS_MAX_SUBSCRIBERS = 1000
+
+    # N-up printing of several labels across an endless roll
+    IMPOSITION_DEFAULT_GUTTER = 24
+    IMPOSITION_MAX_LENGTH = 2400
+
+    # Label templates (<name>.json) for serialized runs, see the README
+    TEMPLATE_FOLDER = os.path.join(basedir, 'instance', 'templates')
+
     FONT_FOLDER = ''
+    # Fonts and their glyph coverage are persisted here after scanning
+    FONT_INDEX_FILE = os.path.join(basedir, 'instance', 'fonts.json')
+    # Families tried first for characters missing in the selected font
+    LABEL_FALLBACK_FONT_FAMILIES = (
+        'DejaVu Sans', 'Noto Sans', 'Noto Sans CJK JP', 'Noto Sans Symbols', 'Noto Sans Symbols2')
+
+    # Requests with the 'X-Profile: 1' header or '?profile=1' are profiled
+    PROFILE_ENABLED = False
+    PROFILE_FOLDER = os.path.join(basedir, 'instance', 'profiles')
+    PROFILE_MAX_FILES = 50